@@ -0,0 +1,99 @@
+import hashlib, os, pickle, sqlite3, time, zlib
+from collections import namedtuple
+from typing import Optional
+
+import lizard
+from pydriller.domain.commit import Modification
+
+# Subset of the PyDriller/Lizard method attributes used by the miner
+CachedMethod = namedtuple('CachedMethod', ['name', 'start_line', 'end_line', 'nloc', 'complexity', 'token_count', 'fan_in', 'fan_out', 'general_fan_out', 'parameters'])
+FileAnalysis = namedtuple('FileAnalysis', ['methods', 'nloc', 'complexity', 'token_count'])
+
+# Seconds after which a hit refreshes the access time of an entry, within them the eviction order is approximate
+ACCESS_REFRESH = 3600
+
+
+def blob_sha(source: str) -> str:
+    # Same hash GIT gives to the blob of a file with the given content
+    data = source.encode('utf-8')
+    return hashlib.sha1(b'blob ' + str(len(data)).encode() + b'\0' + data).hexdigest()
+
+
+class AnalysisCache:
+    """
+    On disk cache of the Lizard analysis of a file, keyed by the SHA of its blob and its extension (Lizard picks the language from it).
+    Entries are evicted in least recently used order when the size of the cache exceeds max_bytes.
+    The cache is cleared when it was filled by another version of Lizard.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # Autocommit and WAL let several mining processes share the same cache
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS analysis (key TEXT PRIMARY KEY, data BLOB, size INTEGER, last_access REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS analysis_last_access ON analysis (last_access)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+        self.check_version()
+        self.size = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM analysis').fetchone()[0]
+
+    def check_version(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        row = self.db.execute("SELECT value FROM meta WHERE name = 'lizard_version'").fetchone()
+        if row is None or row[0] != lizard.version:
+            if row is not None:
+                print('Analysis cache filled by Lizard {}, cleared for Lizard {}'.format(row[0], lizard.version))
+            self.db.execute('DELETE FROM analysis')
+            self.db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('lizard_version', ?)", (lizard.version,))
+        self.db.execute('COMMIT')
+
+    def analyze(self, mod: Modification) -> FileAnalysis:
+        if mod.source_code is None:
+            # Deleted files have nothing to parse
+            return FileAnalysis(mod.methods, mod.nloc, mod.complexity, mod.token_count)
+        key = blob_sha(mod.source_code) + os.path.splitext(mod.filename)[1]
+        analysis = self.get(key)
+        if analysis is None:
+            methods = [CachedMethod(m.name, m.start_line, m.end_line, m.nloc, m.complexity, m.token_count, m.fan_in, m.fan_out, m.general_fan_out, tuple(m.parameters)) for m in mod.methods]
+            analysis = FileAnalysis(methods, mod.nloc, mod.complexity, mod.token_count)
+            self.put(key, analysis)
+        return analysis
+
+    def get(self, key: str) -> Optional[FileAnalysis]:
+        row = self.db.execute('SELECT data, last_access FROM analysis WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # Most hits only read, so the processes sharing the cache do not wait for each other's writes
+        now = time.time()
+        if now - row[1] > ACCESS_REFRESH:
+            self.db.execute('UPDATE analysis SET last_access = ? WHERE key = ?', (now, key))
+        methods, nloc, complexity, token_count = pickle.loads(zlib.decompress(row[0]))
+        return FileAnalysis([CachedMethod(*m) for m in methods], nloc, complexity, token_count)
+
+    def put(self, key: str, analysis: FileAnalysis):
+        data = zlib.compress(pickle.dumps(([tuple(m) for m in analysis.methods], analysis.nloc, analysis.complexity, analysis.token_count), protocol=pickle.HIGHEST_PROTOCOL))
+        self.db.execute('INSERT OR REPLACE INTO analysis (key, data, size, last_access) VALUES (?, ?, ?, ?)', (key, data, len(data), time.time()))
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        # Other processes may have changed the cache, start from its real size and free 10% more than needed
+        self.size = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM analysis').fetchone()[0]
+        target = self.max_bytes * 0.9
+        while self.size > target:
+            rows = self.db.execute('SELECT key, size FROM analysis ORDER BY last_access LIMIT 100').fetchall()
+            if not rows:
+                break
+            self.db.executemany('DELETE FROM analysis WHERE key = ?', [(key,) for key, size in rows])
+            self.size -= sum(size for key, size in rows)
+
+    def close(self):
+        print('Analysis cache: {} hits, {} misses, {:.1f} MB'.format(self.hits, self.misses, self.size / 1024 / 1024))
+        self.db.close()
@@ -0,0 +1,108 @@
+from typing import List, Set, Tuple
+from pydriller import RepositoryMining, GitRepository, Commit
+from pydriller.domain.commit import ModificationType
+
+from method_histories import MethodHistories, append_bean, get_horizons
+from method_metrics import MetricsBean
+from miner import Miner
+from saver import WINDOW
+
+
+class PredictedCommit:
+    """
+    Histories of the methods touched by a commit to predict, the same state Miner.mine_methods keeps mining that commit alone.
+    """
+
+    def __init__(self, commit_hash: str, filter_methods: Set[str], filter_files: Set[str]):
+        self.commit_hash = commit_hash
+        self.filter_methods = filter_methods
+        self.filter_files = filter_files
+        self.methods = MethodHistories()  # path$$method -> List[MetricsBean]
+        self.flushed = []  # (key, history) of histories closed by an ADD
+
+    def get_histories(self) -> List[Tuple[str, List[MetricsBean]]]:
+        # Same order in which the Saver receives them
+        return self.flushed + list(self.methods.items())
+
+
+class BatchMiner(Miner):
+    """
+    Mines once the history shared by many commits to predict, from the newest one back to the stop commit.
+    The beans of a commit are calculated once for all the predicted commits that need them, each one keeps its own histories so renames and ADDs are applied as in a single run.
+    """
+
+    def __init__(self, repo_path: str, allowed_extensions: List[str], cache_path: str = None, cache_size: int = 0, window: int = WINDOW):
+        super().__init__(repo_path, allowed_extensions, None, cache_path=cache_path, cache_size=cache_size, window=window)
+
+    def mine_batch(self, commits: List[str], stop_commit: str) -> List[Tuple[str, str, List[MetricsBean]]]:
+        """
+        Return (commit, key, history) of the methods touched by each commit, the rows tester.py gets mining the commit alone.
+        """
+        print('Mining: ' + self.repo_path)
+        gr = GitRepository(self.repo_path)
+        commits = [gr.get_commit(commit_hash).hash for commit_hash in commits]
+        # The walk starts from the most recent commit to predict
+        first_commit = gr.repo.git.rev_list('--no-walk=sorted', *commits).split()[0]
+        first_commit, last_commit = self.resolve_commits(gr, first_commit, stop_commit)
+        walk = self.list_commits(gr, first_commit, last_commit)
+        self.horizons = get_horizons(walk)
+        commits_to_analyze = len(walk)
+
+        targets = set(commits)
+        predicted = {}  # commit -> PredictedCommit
+        filter_methods = set()  # Union of the filters of the predicted commits
+        filter_files = set()
+        commit_count = 0
+        self.open_analysis_cache()
+        for commit in RepositoryMining(self.repo_path, from_commit=first_commit, to_commit=last_commit, reversed_order=True).traverse_commits():
+            if commit.hash in targets:
+                touched_methods, touched_files = self.get_touched_methods(commit)
+                predicted[commit.hash] = PredictedCommit(commit.hash, touched_methods, touched_files)
+                filter_methods.update(touched_methods)
+                filter_files.update(touched_files)
+            mod_analyzed_count = self.mine_commit_batch(commit, predicted.values(), filter_methods, filter_files)
+            commit_count += 1
+            # Methods with an open history in at least a predicted commit
+            open_methods = set().union(*(target.methods.keys() for target in predicted.values()))
+            self.print_progress(open_methods, commit, commit_count, commits_to_analyze, mod_analyzed_count)
+        self.close_analysis_cache()
+
+        results = []
+        for commit_hash in commits:
+            if commit_hash not in predicted:
+                print('Commit not found between the most recent commit and the stop commit: ' + commit_hash)
+                continue
+            for key, history in predicted[commit_hash].get_histories():
+                results.append((commit_hash, key, history))
+        return results
+
+    def mine_commit_batch(self, commit: Commit, predicted: List[PredictedCommit], filter_methods: Set[str], filter_files: Set[str]) -> int:
+        buggy = True if commit.hash in self.bic_commits else False
+        fix = True if commit.hash in self.fix_commits else False
+        mod_analyzed_count = 0
+        count_files_per_commit = len(commit.modifications)
+        for mod in commit.modifications:
+            if mod.new_path in filter_files and mod.filename.endswith(tuple(self.allowed_extensions)):
+                mod_analyzed_count += 1
+                # Beans needed by at least a predicted commit, in the order Miner.mine_commit creates them
+                beans = []
+                analysis = self.analyze_modification(mod)
+                for method in analysis.methods:
+                    key = self.get_unique_key(mod.new_path, mod.old_path, method.name)
+                    if key in filter_methods:
+                        beans.append((key, self.create_bean(commit, mod, analysis, method, buggy, fix, count_files_per_commit)))
+                # Replay Miner.mine_commit on the histories of every predicted commit
+                for target in predicted:
+                    if mod.new_path in target.filter_files:
+                        if mod.change_type is ModificationType.RENAME:
+                            target.methods = self.update_keys(target.methods, mod.new_path, mod.old_path)
+                            target.filter_files.add(mod.old_path)
+                            filter_files.add(mod.old_path)
+                        for key, mb in beans:
+                            if key in target.filter_methods:
+                                if key not in target.methods:
+                                    target.methods[key] = self.new_history(key)
+                                append_bean(target.methods[key], mb, self.window, self.horizons.get(commit.hash))
+                                if mod.change_type is ModificationType.ADD:
+                                    target.flushed.append((key, target.methods.pop(key)))
+        return mod_analyzed_count
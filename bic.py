@@ -1,10 +1,19 @@
 import argparse, csv
 import os
+from collections import OrderedDict
+from datetime import datetime
+from itertools import islice
+from multiprocessing import Pool, Queue
+from tempfile import TemporaryDirectory
+from typing import Dict, List, Set, Tuple
 from pydriller import Commit
 
 from pydriller import GitRepository
 from pydriller.domain.commit import Modification
 
+from checkpoint import save_checkpoint, load_checkpoint
+from miner import clone_repository
+
 
 def get_method_count(modifications):
     count = 0
@@ -27,6 +36,153 @@ def get_fix_mod_by_path(commit: Commit, bic_path: str) -> Modification:
     return None
 
 
+def read_ignore_commits(ignore_path: str) -> Set[str]:
+    # One HASH per line, empty lines and comments as in the ignore-revs files of git blame are skipped
+    ignore_commits = set()
+    with open(ignore_path, 'r', encoding="utf-8") as ignore_file:
+        for line in ignore_file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                ignore_commits.add(line)
+    return ignore_commits
+
+
+class CommitMetadataCache:
+    """
+    Committer date and number of modifications of the BIC commits, the same BIC is often found by many fix commits and loading a commit is expensive.
+    At most max_size commits are kept, the least recently used are evicted first.
+    """
+
+    def __init__(self, gr: GitRepository, max_size: int, entries: Dict[str, Tuple[datetime, int]] = None):
+        self.gr = gr
+        self.max_size = max_size
+        self.entries = OrderedDict(entries if entries is not None else {})
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, commit_hash: str) -> Tuple[datetime, int]:
+        metadata = self.entries.get(commit_hash)
+        if metadata is not None:
+            self.hits += 1
+            self.entries.move_to_end(commit_hash)
+            return metadata
+        self.misses += 1
+        commit = self.gr.get_commit(commit_hash)
+        metadata = (commit.committer_date, len(commit.modifications))
+        self.put(commit_hash, metadata)
+        return metadata
+
+    def put(self, commit_hash: str, metadata: Tuple[datetime, int]):
+        self.entries[commit_hash] = metadata
+        self.entries.move_to_end(commit_hash)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def print_stats(self):
+        print('Metadata cache: {} hits, {} misses, {} commits'.format(self.hits, self.misses, len(self.entries)))
+
+
+def get_repo_id(gr: GitRepository) -> str:
+    # Root commits of HEAD, the same for every clone of the repository
+    return ' '.join(sorted(gr.repo.git.rev_list('--max-parents=0', 'HEAD').split()))
+
+
+def load_metadata(metadata_path: str, repo_id: str) -> Dict[str, Tuple[datetime, int]]:
+    # Entries saved by a previous run, from the least recently used
+    if metadata_path is None:
+        return None
+    saved = load_checkpoint(metadata_path)
+    if saved is None:
+        return None
+    if not isinstance(saved, dict) or saved.get('repo') != repo_id:
+        print('The metadata cache {} was not saved for the repository {}, remove it or pass another file'.format(metadata_path, repo_id))
+        exit(-1)
+    print('Loaded the metadata of {} commits from {}'.format(len(saved['entries']), metadata_path))
+    return saved['entries']
+
+
+def save_metadata(metadata_path: str, repo_id: str, metadata: CommitMetadataCache):
+    save_checkpoint(metadata_path, {'repo': repo_id, 'entries': metadata.entries})
+    print('Saved the metadata of {} commits in {}'.format(len(metadata.entries), metadata_path))
+
+
+def process_fix(gr: GitRepository, fix: Dict[str, str], input_columns: List[str], notuse: str, ignore_commits: Set[str], metadata: CommitMetadataCache) -> Tuple[str, List[Dict], List[str], int, int]:
+    # The hits and the misses of the metadata cache are returned too, the workers have their own cache
+    rows = []
+    messages = []
+    hits, misses = metadata.hits, metadata.misses
+    git_hash = fix['git_hash']
+    fix_commit = gr.get_commit(git_hash)
+    for mod in fix_commit.modifications:
+        if mod.filename.endswith('.cpp'):
+            if notuse:
+                bic_mods = gr.get_commits_last_modified_lines(fix_commit, mod, hashes_to_ignore_path=notuse)
+            else:
+                bic_mods = gr.get_commits_last_modified_lines(fix_commit, mod)
+            messages.append('   ==> {} has {} MOD, {} BIC'.format(git_hash, len(bic_mods), get_bic_count(bic_mods)))
+
+            dout = {'git_timestamp': fix_commit.committer_date,
+                    'git_modifications': len(fix_commit.modifications),
+                    'git_methods': get_method_count(fix_commit.modifications),
+                    'bic_count': len(bic_mods)}
+            # Append the ancillary data contained in the input file
+            for ic in input_columns:
+                dout[ic] = fix[ic]
+
+            for bic_path, bic_commit_hashs in bic_mods.items():
+                fix_mod = get_fix_mod_by_path(fix_commit, bic_path)
+                if fix_mod is not None:
+                    dout['fix_added'] = fix_mod.added
+                    dout['fix_removed'] = fix_mod.removed
+
+                for bic_commit_hash in bic_commit_hashs:
+                    if bic_commit_hash not in ignore_commits:
+                        bic_timestamp, bic_modifications = metadata.get(bic_commit_hash)
+                        dout['bic_commit'] = bic_commit_hash
+                        dout['bic_path'] = bic_path
+                        dout['bic_timestamp'] = bic_timestamp
+                        dout['bic_modifications'] = bic_modifications
+                        # dout['bic_methods'] = get_method_count(bic_commit.modifications)
+                        rows.append(dict(dout))
+    return git_hash, rows, messages, metadata.hits - hits, metadata.misses - misses
+
+
+def read_checkpoint(checkpoint_path: str) -> Tuple[int, str, int]:
+    # Each line is: fix commits completed, hash of the last one, size of the output file at that point
+    checkpoint = None
+    if os.path.isfile(checkpoint_path):
+        with open(checkpoint_path, 'r', encoding="utf-8") as checkpoint_file:
+            for line in checkpoint_file:
+                fields = line.strip().split(',')
+                # A truncated last line is ignored
+                if len(fields) == 3 and fields[0].isdigit() and fields[2].isdigit():
+                    checkpoint = (int(fields[0]), fields[1], int(fields[2]))
+    return checkpoint
+
+
+def write_checkpoint(checkpoint_file, out_file, count: int, git_hash: str):
+    # The output must be on disk before the checkpoint that refers to it
+    out_file.flush()
+    os.fsync(out_file.fileno())
+    checkpoint_file.write('{},{},{}\n'.format(count, git_hash, os.fstat(out_file.fileno()).st_size))
+    checkpoint_file.flush()
+
+
+# Clone of the repository and metadata cache of each --jobs worker, set up once by init_worker
+worker_state = {}
+
+
+def init_worker(clones: Queue, input_columns: List[str], notuse: str, ignore_commits: Set[str], metadata_size: int, metadata_entries: Dict[str, Tuple[datetime, int]]):
+    gr = GitRepository(clones.get())
+    # Each worker has its own cache, the main process collects the metadata of the rows it receives
+    metadata = CommitMetadataCache(gr, metadata_size, metadata_entries)
+    worker_state.update(gr=gr, input_columns=input_columns, notuse=notuse, ignore_commits=ignore_commits, metadata=metadata)
+
+
+def process_fix_worker(fix: Dict[str, str]) -> Tuple[str, List[Dict], List[str], int, int]:
+    return process_fix(worker_state['gr'], fix, worker_state['input_columns'], worker_state['notuse'], worker_state['ignore_commits'], worker_state['metadata'])
+
+
 # Main
 if __name__ == '__main__':
     print("*** BIC started ***\n")
@@ -36,7 +192,13 @@ if __name__ == '__main__':
     parser.add_argument('-n', '--notuse', type=str, help='ABSOLUTE path of a text file that contains a list of commits, one per line, to ignore', default=None)  # 'data/ignore_commits.txt'
     parser.add_argument('-d', '--delimiter', type=str, help='The CSV delimiter', default=',')
     parser.add_argument('-f', '--fix', type=str, help='The name of the column in the input CSV file used to identify the GIT HASH of a fix commit.', default='git_hash')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of fix commits processed in parallel.', default=1)
     parser.add_argument('-o', '--output', type=str, help='A CSV file where save bug inducing commits found with SZZ algorithm.', default='data/bic_commits.csv')
+    parser.add_argument('-k', '--checkpoint', type=str, help='A text file where the progress is saved after each fix commit. If not specified, it is the output file name followed by .checkpoint', default=None)
+    parser.add_argument('-mc', '--metadata_cache', type=str, help='A file where the date and the number of modifications of the BIC commits are saved during the run and reused by the next runs.', default=None)
+    parser.add_argument('-mi', '--metadata_interval', type=int, help='Number of fix commits processed between two saves of the metadata cache.', default=100)
+    parser.add_argument('-ms', '--metadata_size', type=int, help='Maximum number of BIC commits whose metadata is kept in memory by each process.', default=100000)
+    parser.add_argument('--resume', action='store_true', help='Resume an interrupted run from its checkpoint, appending to the output file.')
     args, unknown = parser.parse_known_args()
 
     # Check that a valid repos is specified
@@ -59,59 +221,77 @@ if __name__ == '__main__':
     input_columns = header.strip().split(args.delimiter)
 
     # Read commits to ignore
-    ignore_commits = []
+    ignore_commits = set()
     if args.notuse is not None:
-        ignore_file = open(args.notuse, 'r', encoding="utf-8")
-        ignore_commits = ignore_file.readlines()
-        ignore_file.close()
+        ignore_commits = read_ignore_commits(args.notuse)
+        print('Found {} commits to ignore'.format(len(ignore_commits)))
+    gr = GitRepository(args.repo)
+    repo_id = get_repo_id(gr)
+    metadata_entries = load_metadata(args.metadata_cache, repo_id)
+
+    # Read the progress of an interrupted run
+    checkpoint_path = args.checkpoint if args.checkpoint is not None else args.output + '.checkpoint'
+    checkpoint = read_checkpoint(checkpoint_path) if args.resume else None
+    if args.resume and (checkpoint is None or not os.path.isfile(args.output)):
+        print('No checkpoint found in {}, start from the first fix commit'.format(checkpoint_path))
+        checkpoint = None
 
     # Prepare the column names for the output file
     header = input_columns + ['git_timestamp', 'git_modifications', 'git_methods', 'fix_added', 'fix_removed', 'bic_count', 'bic_commit', 'bic_path', 'bic_timestamp', 'bic_modifications']
-    out_file = open(args.output, 'w', newline='', encoding="utf-8")
-    writer = csv.DictWriter(out_file, delimiter=args.delimiter, fieldnames=header)
-    writer.writeheader()
+    if checkpoint is not None:
+        # Drop the rows of the fix commit that was running when the previous run stopped
+        count, last_hash, offset = checkpoint
+        os.truncate(args.output, offset)
+        out_file = open(args.output, 'a', newline='', encoding="utf-8")
+        writer = csv.DictWriter(out_file, delimiter=args.delimiter, fieldnames=header)
+        checkpoint_file = open(checkpoint_path, 'a', encoding="utf-8")
+        print('Resume after {} fix commits, the last one was {}'.format(count, last_hash))
+    else:
+        count = 0
+        out_file = open(args.output, 'w', newline='', encoding="utf-8")
+        writer = csv.DictWriter(out_file, delimiter=args.delimiter, fieldnames=header)
+        writer.writeheader()
+        checkpoint_file = open(checkpoint_path, 'w', encoding="utf-8")
 
     # Perform Git blame to retrieve the list of BIC commits
-    gr = GitRepository(args.repo)
     fixes = csv.DictReader(open(args.csv, 'r', newline='', encoding="utf-8"), delimiter=args.delimiter)
-    count = 0
-    for fix in fixes:
-        git_hash = fix['git_hash']
+    fixes = islice(fixes, count, None)
+    if args.jobs > 1:
+        clones_dir = TemporaryDirectory(prefix='bic-')
+        clones = Queue()
+        for i in range(args.jobs):
+            clones.put(clone_repository(gr, os.path.join(clones_dir.name, str(i))))
+        pool = Pool(args.jobs, initializer=init_worker, initargs=(clones, input_columns, args.notuse, ignore_commits, args.metadata_size, metadata_entries))
+        # imap returns the results in the same order of the input file
+        results = pool.imap(process_fix_worker, fixes)
+        metadata = CommitMetadataCache(None, args.metadata_size, metadata_entries)
+    else:
+        metadata = CommitMetadataCache(gr, args.metadata_size, metadata_entries)
+        results = (process_fix(gr, fix, input_columns, args.notuse, ignore_commits, metadata) for fix in fixes)
+    hits, misses = 0, 0
+    for git_hash, rows, messages, fix_hits, fix_misses in results:
         print('{}) Processing {} '.format(count, git_hash))
-        fix_commit = gr.get_commit(git_hash)
-        for mod in fix_commit.modifications:
-            if mod.filename.endswith('.cpp'):
-                if args.notuse:
-                    bic_mods = gr.get_commits_last_modified_lines(fix_commit, mod, hashes_to_ignore_path=args.notuse)
-                else:
-                    bic_mods = gr.get_commits_last_modified_lines(fix_commit, mod)
-                print('   ==> {} has {} MOD, {} BIC'.format(git_hash, len(bic_mods), get_bic_count(bic_mods)))
-
-                dout = {'git_timestamp': fix_commit.committer_date,
-                        'git_modifications': len(fix_commit.modifications),
-                        'git_methods': get_method_count(fix_commit.modifications),
-                        'bic_count': len(bic_mods)}
-                # Append the ancillary data contained in the input file
-                for ic in input_columns:
-                    dout[ic] = fix[ic]
-
-                for bic_path, bic_commit_hashs in bic_mods.items():
-                    fix_mod = get_fix_mod_by_path(fix_commit, bic_path)
-                    if fix_mod is not None:
-                        dout['fix_added'] = fix_mod.added
-                        dout['fix_removed'] = fix_mod.removed
-
-                    for bic_commit_hash in bic_commit_hashs:
-                        if bic_commit_hash not in ignore_commits:
-                            bic_commit = gr.get_commit(bic_commit_hash)
-                            dout['bic_commit'] = bic_commit_hash
-                            dout['bic_path'] = bic_path
-                            dout['bic_timestamp'] = bic_commit.committer_date
-                            dout['bic_modifications'] = len(bic_commit.modifications)
-                            # dout['bic_methods'] = get_method_count(bic_commit.modifications)
-                            writer.writerow(dout)
+        for message in messages:
+            print(message)
+        for row in rows:
+            writer.writerow(row)
+            metadata.put(row['bic_commit'], (row['bic_timestamp'], row['bic_modifications']))
+        hits += fix_hits
+        misses += fix_misses
         count += 1
-        out_file.flush()
+        write_checkpoint(checkpoint_file, out_file, count, git_hash)
+        # Saved with the progress, an interrupted run keeps the metadata loaded so far
+        if args.metadata_cache is not None and count % args.metadata_interval == 0:
+            save_metadata(args.metadata_cache, repo_id, metadata)
+    if args.jobs > 1:
+        pool.close()
+        pool.join()
+        clones_dir.cleanup()
+    metadata.hits, metadata.misses = hits, misses
+    metadata.print_stats()
     out_file.close()
+    checkpoint_file.close()
+    if args.metadata_cache is not None and count % args.metadata_interval != 0:
+        save_metadata(args.metadata_cache, repo_id, metadata)
 
     print("\n*** BIC ended ***")
@@ -0,0 +1,23 @@
+import gzip, os, pickle
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+
+@contextmanager
+def write_aside(path: str) -> Iterator[str]:
+    # Write aside and rename, a crash while writing leaves the previous file untouched and a reader never sees a partial one
+    temp_path = path + '.tmp'
+    yield temp_path
+    os.replace(temp_path, path)
+
+
+def save_checkpoint(path: str, state: Dict):
+    with write_aside(path) as temp_path, gzip.open(temp_path, 'wb', compresslevel=1) as fout:
+        pickle.dump(state, fout, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_checkpoint(path: str) -> Dict:
+    if not os.path.isfile(path):
+        return None
+    with gzip.open(path, 'rb') as fin:
+        return pickle.load(fin)
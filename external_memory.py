@@ -0,0 +1,99 @@
+import os
+from tempfile import TemporaryDirectory
+from typing import List, Tuple
+
+import numpy
+import xgboost
+from sklearn.preprocessing import StandardScaler
+from xgboost import XGBClassifier
+
+from loader import iter_columns, CHUNK_SIZE
+
+
+def fit_scaler(path: str, names: List[str], chunk_size: int = CHUNK_SIZE) -> StandardScaler:
+    # First pass over the dataset, the standardization is fitted one chunk at a time
+    scaler = StandardScaler()
+    for chunk in iter_columns(path, names, chunk_size):
+        scaler.partial_fit(chunk)
+    return scaler
+
+
+def split_mask(chunk_index: int, rows: int, test_size: float, seed: int) -> numpy.ndarray:
+    # Rows of a chunk held out for testing, the same at every pass over the dataset
+    return numpy.random.default_rng((seed, chunk_index)).random(rows) < test_size
+
+
+class DatasetIter(xgboost.DataIter):
+    """
+    Streams the standardized float32 chunks of a dataset to XGBoost, the training or the testing rows only.
+    XGBoost reads the chunks again at every reset, with a cache prefix it keeps its own copy on disk instead of in memory.
+    """
+
+    def __init__(self, path: str, names: List[str], scaler: StandardScaler, test: bool, test_size: float, seed: int, chunk_size: int = CHUNK_SIZE, cache_prefix: str = None):
+        self.path = path
+        self.names = names
+        self.scaler = scaler
+        self.test = test
+        self.test_size = test_size
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.chunks = None
+        self.chunk_index = 0
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next_chunk(self) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        # Next non empty (x, y) of the selected rows, None at the end of the dataset
+        if self.chunks is None:
+            self.chunks = iter_columns(self.path, self.names, self.chunk_size)
+        for chunk in self.chunks:
+            mask = split_mask(self.chunk_index, len(chunk), self.test_size, self.seed)
+            self.chunk_index += 1
+            if not self.test:
+                mask = ~mask
+            if mask.any():
+                chunk = chunk[mask]
+                x = self.scaler.transform(chunk[:, :-1]).astype(numpy.float32)
+                return x, chunk[:, -1].astype(numpy.float32)
+        return None
+
+    def next(self, input_data) -> bool:
+        data = self.next_chunk()
+        if data is None:
+            return False
+        input_data(data=data[0], label=data[1])
+        return True
+
+    def reset(self):
+        self.chunks = None
+        self.chunk_index = 0
+
+
+def train_external(path: str, names: List[str], scaler: StandardScaler, params: dict, rounds: int, test_size: float, seed: int, chunk_size: int, cache_dir: str) -> XGBClassifier:
+    """
+    Train XGBoost on the training rows of a dataset larger than the memory, the quantized pages are kept in a temporary directory inside cache_dir, removed at the end.
+    The names end with the label, the returned classifier can be saved in a bundle as the one trained in memory.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    # Only the pages of this training are removed, cache_dir may hold other files
+    with TemporaryDirectory(prefix='xgboost-', dir=cache_dir) as pages_dir:
+        train_iter = DatasetIter(path, names, scaler, False, test_size, seed, chunk_size, os.path.join(pages_dir, 'train'))
+        dtrain = xgboost.ExtMemQuantileDMatrix(train_iter)
+        booster = xgboost.train(dict(params, objective='binary:logistic', tree_method='hist'), dtrain, num_boost_round=rounds, evals=[(dtrain, 'train')], verbose_eval=10)
+        del dtrain
+    model = XGBClassifier()
+    model.load_model(booster.save_raw(raw_format='ubj'))
+    return model
+
+
+def predict_external(model: XGBClassifier, path: str, names: List[str], scaler: StandardScaler, test_size: float, seed: int, chunk_size: int) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    # Labels and predictions of the testing rows, one chunk at a time
+    test_iter = DatasetIter(path, names, scaler, True, test_size, seed, chunk_size)
+    y_test, y_pred = [], []
+    data = test_iter.next_chunk()
+    while data is not None:
+        y_test.append(data[1] > 0.5)
+        y_pred.append(model.predict(data[0]) > 0.5)
+        data = test_iter.next_chunk()
+    if len(y_test) == 0:
+        return numpy.empty(0, dtype=bool), numpy.empty(0, dtype=bool)
+    return numpy.concatenate(y_test), numpy.concatenate(y_pred)
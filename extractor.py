@@ -2,6 +2,9 @@ import argparse, csv, os
 from typing import Set
 
 from miner import Miner
+from saver import OUTPUT_FORMATS, WINDOW
+from incremental import mine_methods_incremental
+from shards import mine_methods_sharded
 
 
 def get_bic_commits(bic_path: str, column_name: str) -> Set[str]:
@@ -43,7 +46,18 @@ if __name__ == '__main__':
     parser.add_argument('-f', '--fix', type=str, help='Path of the CSV file containing the list of bug inducing commits', default=None)
     parser.add_argument('-bn', '--bic_name', type=str, help='The name of the column in the input CSV file used to identify the GIT HASH of a bic commit.', default='bic_commit')
     parser.add_argument('-fn', '--fix_name', type=str, help='The name of the column in the input CSV file used to identify the GIT HASH of a bic commit.', default='git_hash')
+    parser.add_argument('-w', '--workers', type=int, help='Number of processes mining the commit range in parallel shards.', default=1)
     parser.add_argument('-o', '--output', type=str, help='Path of the CSV file where to save results.', default='data/method_metrics_geko-dev-2.csv')
+    parser.add_argument('--format', type=str, choices=OUTPUT_FORMATS, help='Format of the output file, Parquet requires the pyarrow package.', default='csv')
+    parser.add_argument('-c', '--checkpoint', type=str, help='Path of the file where the state of the mining is periodically saved. If not specified, it is the output file name followed by .checkpoint', default=None)
+    parser.add_argument('-ci', '--checkpoint_interval', type=int, help='Number of commits mined between two checkpoints.', default=500)
+    parser.add_argument('-a', '--cache', type=str, help='Path of the cache of the Lizard analysis of every mined file version, shared among runs.', default=None)
+    parser.add_argument('-as', '--cache_size', type=int, help='Maximum size of the analysis cache in MB.', default=2048)
+    parser.add_argument('-bs', '--batch_size', type=int, help='Number of method changes aggregated together before converting them to CSV rows.', default=100000)
+    parser.add_argument('-bf', '--buffer', type=int, help='Size in KB of the CSV rows kept in memory before writing them to the output file, at the end of a commit.', default=4096)
+    parser.add_argument('-wd', '--window', type=int, help='Days of changes aggregated for each method, counted from its oldest change.', default=WINDOW // (24 * 3600))
+    parser.add_argument('--resume', action='store_true', help='Resume an interrupted run from its checkpoint, appending to the output file.')
+    parser.add_argument('--incremental', type=str, help='Path of the state kept between runs: only the commits added since the previous run are mined and the rows of the methods they changed are replaced in the output file of the previous run.', default=None)
     args, unknown = parser.parse_known_args()
 
     # Check that a valid repos is specified
@@ -53,6 +67,25 @@ if __name__ == '__main__':
 
     bic_commits = get_bic_commits(args.bic, args.bic_name)
     fix_commits = get_fix_commits(args.fix, args.fix_name)
-    miner = Miner(args.repo, args.ext, args.output, bic_commits, fix_commits)
-    miner.mine_methods(args.start, args.stop)
+    checkpoint_path = args.checkpoint if args.checkpoint is not None else args.output + '.checkpoint'
+    if args.format != 'csv':
+        # Only a CSV file can be truncated and extended after a checkpoint
+        if args.resume:
+            print('The --resume option is available only with the CSV format')
+            exit(-1)
+        checkpoint_path = None
+    miner = Miner(args.repo, args.ext, args.output, bic_commits, fix_commits, checkpoint_path, args.checkpoint_interval, args.cache, args.cache_size * 1024 * 1024,
+                  args.batch_size, args.buffer * 1024, args.format, args.window * 24 * 3600)
+    if args.incremental is not None:
+        if args.resume or args.workers > 1:
+            print('The --incremental option cannot be used with --resume or more than one worker')
+            exit(-1)
+        mine_methods_incremental(miner, args.start, args.stop, args.incremental)
+    elif args.workers > 1:
+        if args.resume:
+            print('The --resume option is available only when mining with a single worker')
+            exit(-1)
+        mine_methods_sharded(miner, args.start, args.stop, args.workers)
+    else:
+        miner.mine_methods(args.start, args.stop, resume=args.resume)
     print("\n*** Extractor ended ***")
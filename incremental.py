@@ -0,0 +1,178 @@
+import os
+from typing import Dict, Set
+from pydriller import GitRepository
+
+from checkpoint import save_checkpoint, load_checkpoint, write_aside
+from method_histories import MethodHistories, append_bean, get_horizons, join_histories
+from miner import Miner
+from saver import create_saver
+from shards import ShardMiner
+
+
+def mine_methods_incremental(miner: Miner, start_commit: str, stop_commit: str, state_path: str) -> int:
+    """
+    Mine only the commits added since the previous run and replace in the output file the rows of the methods they changed.
+    The state file keeps the beans of the range a windowed extraction keeps as a single shard: the new commits are mined as a newer shard and compacted with it.
+    The stop commit can move forward, the beans left out of the range are dropped and the rows of the methods that lose some of them are written again.
+    """
+    print('Mining: ' + miner.repo_path)
+    gr = GitRepository(miner.repo_path)
+    state = load_checkpoint(state_path)
+    if state is not None and not os.path.isfile(miner.csv_file):
+        print('The output file of the previous run {} is missing, the rows of the methods not changed since then are in it'.format(miner.csv_file))
+        exit(-1)
+    if stop_commit is None and state is not None:
+        stop_commit = state['range'][1]
+    first_commit, last_commit = miner.resolve_commits(gr, start_commit, stop_commit)
+    first_commit = gr.get_commit(first_commit).hash
+    last_commit = gr.get_commit(last_commit).hash if last_commit is not None else None
+    commits = miner.list_commits(gr, first_commit, last_commit)
+    range_commits = set(commit_hash for commit_hash, timestamp in commits)
+    horizons = get_horizons(commits)
+
+    if state is None:
+        print('No previous state, mine the whole range')
+        hashes = [commit_hash for commit_hash, timestamp in commits]
+    else:
+        previous_first, previous_last = state['range']
+        if not gr.repo.is_ancestor(previous_first, first_commit):
+            print('The last mined commit {} is not an ancestor of {}, the whole range must be mined again'.format(previous_first, first_commit))
+            exit(-1)
+        if previous_last != last_commit and (previous_last is None or previous_last in range_commits):
+            print('The range goes back beyond the stop commit of the previous run {}, the whole range must be mined again'.format(previous_last))
+            exit(-1)
+        # The commits not mined yet in the order of the walk, they are expected before all the others
+        hashes = []
+        late = 0  # New commits walked after a mined one
+        mined = False
+        for commit_hash, timestamp in commits:
+            if commit_hash in state['commits']:
+                mined = True
+            else:
+                hashes.append(commit_hash)
+                late += 1 if mined else 0
+        if late > 0:
+            print('{} new commits are walked after commits of the previous runs, only a full extraction mines them in the same order'.format(late))
+    print('Commits to analyze: {}'.format(len(hashes)))
+
+    # The window is applied by evict_shard, which records the ids of the histories that lose some beans
+    shard_miner = ShardMiner(miner.repo_path, miner.allowed_extensions, miner.bic_commits, miner.fix_commits, miner.cache_path, miner.cache_size, None)
+    shard = shard_miner.mine_shard(hashes)
+    shard['evicted'] = set()
+    if state is not None:
+        shard = compact_shards(shard, state['shard'])
+    previous_keys = dict((history_id, key) for key, history_id in shard['flushed'] + shard['open'])
+    trimmed = trim_shard(shard, range_commits)
+    lossy = len(trimmed & shard['evicted'])
+    if lossy > 0:
+        print('{} methods lost their oldest changes after the window dropped some later ones, only a full extraction writes their rows with all the changes of the range'.format(lossy))
+    evict_shard(shard, miner.window, horizons, commits[-1][0] if len(commits) > 0 else None)
+
+    # The methods with a history starting with a new commit, trimmed or dropped, by their keys before and after the trim
+    new_hashes = set(hashes)
+    keys = dict((history_id, key) for key, history_id in shard['flushed'] + shard['open'])
+    changed = [history_id for history_id, history in enumerate(shard['histories']) if len(history) == 0 or history_id in trimmed or history[0].git_hash in new_hashes]
+    changed_keys = set(previous_keys[history_id] for history_id in changed if history_id in previous_keys)
+    changed_keys.update(keys[history_id] for history_id in changed if history_id in keys)
+    print('Histories: {} | Trimmed: {} | Changed methods: {}'.format(len(keys), len(trimmed), len(changed_keys)))
+
+    # The rows of the other methods are copied from the previous output
+    with write_aside(miner.csv_file) as temp_path:
+        saver = create_saver(temp_path, miner.output_format, miner.batch_size, miner.buffer_size, miner.window)
+        saver.create_csv_file()
+        saver.print_csv_header()
+        if state is not None:
+            saver.copy_rows(miner.csv_file, changed_keys)
+        for key, history_id in shard['flushed'] + shard['open']:
+            if key in changed_keys:
+                saver.add_method_to_csv(key, shard['histories'][history_id])
+        saver.close_csv_file()
+
+    save_checkpoint(state_path, {'range': (first_commit, last_commit), 'commits': range_commits, 'shard': shard})
+    print('State saved: {}'.format(state_path))
+    print('Mining ended')
+    return len(hashes)
+
+
+def compact_shards(newer: Dict, older: Dict) -> Dict:
+    """
+    Merge two consecutive shards in a single one, equivalent to merging them in turn with merge_shard.
+    The histories of the older shard continuing an open history of the newer one are joined, only the events still needed by newer commits are kept.
+    The evicted ids of both shards are kept, with the histories whose join drops some beans.
+    """
+    histories = []
+    events = []
+    flushed = []
+    evicted = set()
+    methods = MethodHistories()  # path$$method -> id of the open history in the merged shard
+    for shard in (newer, older):
+        ids = {}  # history id in the shard -> history id in the merged shard
+        for event in shard['events']:
+            if event[0] == 'rename':
+                methods.rename(event[1], event[2])
+                events.append(event)
+                continue
+            history_id = methods.pop(event[1], None)
+            if history_id is None:
+                history_id = len(histories)
+                histories.append(shard['histories'][event[2]])
+                events.append(('start', event[1], history_id))
+            else:
+                history = join_histories(histories[history_id], shard['histories'][event[2]], shard['window'], shard['horizon'])
+                if len(history) < len(histories[history_id]) + len(shard['histories'][event[2]]):
+                    evicted.add(history_id)
+                histories[history_id] = history
+            ids[event[2]] = history_id
+        flushed += [(key, ids[history_id]) for key, history_id in shard['flushed']]
+        evicted.update(ids[history_id] for history_id in shard['evicted'] if history_id in ids)
+        for key, history_id in shard['open']:
+            methods[key] = ids[history_id]
+    return {'histories': histories,
+            'events': events,
+            'flushed': flushed,
+            'open': list(methods.items()),
+            'evicted': evicted,
+            'window': older['window'],
+            'horizon': older['horizon']}
+
+
+def trim_shard(shard: Dict, commits: Set[str]) -> Set[int]:
+    """
+    Drop from a shard the beans and the renames of the commits out of the range, the histories left empty are dropped too.
+    Return the ids of the histories that lost some beans but not all of them.
+    """
+    trimmed = set()
+    histories = shard['histories']
+    for history_id, history in enumerate(histories):
+        if any(bean.git_hash not in commits for bean in history):
+            histories[history_id] = type(history)(bean for bean in history if bean.git_hash in commits)
+            if len(histories[history_id]) > 0:
+                trimmed.add(history_id)
+    shard['events'] = [event for event in shard['events'] if (event[3] in commits if event[0] == 'rename' else len(histories[event[2]]) > 0)]
+    # A trimmed history lost the ADD closing it, the keys of the open histories are rebuilt replaying the renames left
+    shard['flushed'] = [(key, history_id) for key, history_id in shard['flushed'] if len(histories[history_id]) > 0 and history_id not in trimmed]
+    flushed = set(history_id for key, history_id in shard['flushed'])
+    methods = MethodHistories()  # path$$method -> id of the open history
+    for event in shard['events']:
+        if event[0] == 'rename':
+            methods.rename(event[1], event[2])
+        elif event[2] not in flushed:
+            methods[event[1]] = event[2]
+    shard['open'] = list(methods.items())
+    return trimmed
+
+
+def evict_shard(shard: Dict, window: int, horizons: Dict[str, int], last_commit: str):
+    """
+    Drop from the histories of a shard the beans the miner drops mining the commits with the given horizons, appending the beans again in mining order.
+    A range that lost its oldest commits has lower horizons, a window needs fewer beans. The histories that lose some beans are added to the evicted ids of the shard.
+    """
+    for history_id, history in enumerate(shard['histories']):
+        evicted = type(history)()
+        for bean in history:
+            append_bean(evicted, bean, window, horizons.get(bean.git_hash))
+        if len(evicted) < len(history):
+            shard['evicted'].add(history_id)
+        shard['histories'][history_id] = evicted
+    shard['window'] = window
+    shard['horizon'] = horizons.get(last_commit)
@@ -1,6 +1,6 @@
-import argparse
+import argparse, json, os
 
-import numpy, joblib
+import numpy
 from sklearn.preprocessing import StandardScaler
 from sklearn.model_selection import train_test_split
 from sklearn import metrics
@@ -17,14 +17,10 @@ from xgboost import XGBClassifier
 import shap
 import matplotlib
 
-
-def skipper(fname, header=False):
-    with open(fname) as fin:
-        no_comments = (line for line in fin if not line.lstrip().startswith('#'))
-        if header:
-            next(no_comments, None)  # skip header
-        for row in no_comments:
-            yield row
+from loader import load_columns, METRICS, LABEL
+from model_bundle import save_bundle
+from external_memory import fit_scaler, train_external, predict_external, DatasetIter
+from validation import cross_validate, get_candidates, DEFAULT_GRID, SEARCH_TYPES
 
 
 def get_human_readable_feature_names(features_as_header):
@@ -53,23 +49,10 @@ def get_human_readable_feature_names(features_as_header):
     return features_as_header
 
 
-def read_data(input_path: str) -> (List[List[float]], List[int]):
-    # Count columns to split dataset
-    fin = open(input_path)
-    columns = fin.readline().split(",")
-    count = len(columns)
-    fin.close()
-
+def read_data(input_path: str, workers: int = 1, cache: bool = False) -> (List[List[float]], List[int]):
     # Select only metrics and buggy columns
-    # usecols = list(range(5, count - 8))
-    usecols = list(range(4, count - 8)) # Reset to 5 when a new dataset will build
-    usecols.append(count - 1)
-
-    features = []
-    for i in usecols:
-        features.append(columns[i])
-
-    dataset = numpy.loadtxt(skipper(input_path, True), delimiter=",", usecols=usecols)
+    features = METRICS + [LABEL]
+    dataset = load_columns(input_path, features, workers, cache=cache)
     # split into input (X) and output (Y) variables
     x = dataset[:, 0:-1]
     y = dataset[:, -1]
@@ -102,6 +85,33 @@ def create_xgboost_model():
     return model
 
 
+def train_out_of_core(args):
+    # Same steps of the single xgboost training, the dataset is read one chunk at a time and never held in memory as a whole
+    chunk_size = args.chunk * 1024 * 1024
+    features = METRICS + [LABEL]
+    scaler = fit_scaler(args.input, METRICS, chunk_size)
+    print('Features count: ' + str(len(METRICS)))
+    print('Instances count: ' + str(scaler.n_samples_seen_))
+
+    model = train_external(args.input, features, scaler, {'nthread': args.jobs}, 100, 0.3, 0, chunk_size, args.external_cache)
+    y_test, y_pred = predict_external(model, args.input, features, scaler, 0.3, 0, chunk_size)
+
+    cm = metrics.confusion_matrix(y_test, y_pred)
+    print('Confusion metrics:')
+    print(cm)
+    print('F1: {0:.2f}'.format(metrics.f1_score(y_test, y_pred)))
+    print('MCC: {0:.2f}'.format(metrics.matthews_corrcoef(y_test, y_pred)))
+
+    # The feature importance is plotted on the first chunk of training rows
+    x_sample = DatasetIter(args.input, features, scaler, False, 0.3, 0, chunk_size).next_chunk()[0]
+    shap_values = shap.TreeExplainer(model).shap_values(x_sample)
+    shap.summary_plot(shap_values, x_sample, feature_names=get_human_readable_feature_names(METRICS), plot_type="violin", show=False)
+    matplotlib.pyplot.savefig("feature_importance.png", bbox_inches="tight")
+
+    if args.save is not None:
+        save_bundle('data/joblib.dump', model, scaler, METRICS)
+
+
 if __name__ == '__main__':
     print("*** Keras started ***\n")
 
@@ -112,13 +122,40 @@ if __name__ == '__main__':
 
     parser = argparse.ArgumentParser()
     parser.add_argument('-i', '--input', type=str, help='Local absolute or relative path to a valid CSV dataset.', default='data/method_metrics_gecko-dev.csv')
-    parser.add_argument('-k', '--kfolds', type=str, help='Number of k-folds', default=1)
+    parser.add_argument('-k', '--kfolds', type=int, help='Number of k-folds', default=1)
     parser.add_argument('-t', '--type', type=str, help='Model type: tensorflow or xgboost', default='xgboost')
     parser.add_argument('-s', '--save', type=str, help='Save model', default='data/model.h5')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of processes parsing the CSV dataset and training the xgboost folds.', default=os.cpu_count())
+    parser.add_argument('--search', type=str, choices=SEARCH_TYPES, help='Hyperparameter search of the xgboost k-fold validation: every setting of the grid or a random sample of them.', default='none')
+    parser.add_argument('--grid', type=str, help='JSON object mapping XGBClassifier parameters to the list of values to search, a built-in grid if omitted.', default=None)
+    parser.add_argument('--search_iter', type=int, help='Number of settings tried by the random search.', default=20)
+    parser.add_argument('--cache', action='store_true', help='Keep a binary copy of the loaded dataset (.npy) next to the input file, reused until the input changes.')
+    parser.add_argument('--external', action='store_true', help='Out-of-core xgboost training for datasets larger than the memory, the input is streamed in chunks.')
+    parser.add_argument('--chunk', type=int, help='Size in MB of the chunks streamed by the out-of-core training.', default=64)
+    parser.add_argument('--external_cache', type=str, help='Directory where the temporary pages of the out-of-core training are written, in a subdirectory removed at the end.', default='data/xgboost-cache')
     args, unknown = parser.parse_known_args()
 
+    if args.search != 'none' and (args.kfolds < 2 or args.type != 'xgboost'):
+        print('The hyperparameter search requires xgboost and at least 2 k-folds')
+        exit(-1)
+    grid = DEFAULT_GRID
+    if args.grid is not None:
+        try:
+            grid = json.loads(args.grid)
+        except ValueError as e:
+            print('Invalid grid {}: {}'.format(args.grid, e))
+            exit(-1)
+    if args.external and (args.kfolds != 1 or args.type != 'xgboost'):
+        print('The out-of-core training supports only a single xgboost training')
+        exit(-1)
+
+    if args.external:
+        train_out_of_core(args)
+        print("\n*** Keras ended ***")
+        exit(0)
+
     # Read and split in X and Y data from CSV file
-    count, features, x, y = read_data(args.input)
+    count, features, x, y = read_data(args.input, args.jobs, args.cache)
     print('Features count: ' + str(count))
     print('Instances count: ' + str(len(x)))
 
@@ -178,7 +215,19 @@ if __name__ == '__main__':
             if args.type == 'tensorflow':
                 model.save(args.save)
             elif args.type == 'xgboost':
-                joblib.dump(model, 'data/joblib.dump')
+                # The scaler fitted on the training data is saved with the model, tester.py applies it to the new methods
+                save_bundle('data/joblib.dump', model, sc, features[:-1])
+    elif args.type == 'xgboost':
+        # Folds and hyperparameter settings are trained in parallel, each process with its share of the CPUs
+        candidates = get_candidates(args.search, grid, args.search_iter)
+        results = cross_validate(x, y, candidates, args.kfolds, args.jobs)
+        print()
+        for result in results:
+            print('Setting {}'.format(result['params'] if len(result['params']) > 0 else 'default'))
+            for name in ['Accuracy', 'F-score', 'MCC']:
+                print('  {} {:.2f} (+/- {:.2f})'.format(name, result[name][0], result[name][1]))
+        if args.search != 'none':
+            print('Best setting: {}'.format(results[0]['params']))
     else:
         # Use k-fold cross validation test harness
         kfold = StratifiedKFold(n_splits=args.kfolds, shuffle=True)
@@ -0,0 +1,120 @@
+import hashlib, os
+from multiprocessing import Pool
+from typing import Iterator, List, Tuple
+
+import numpy
+
+from checkpoint import write_aside
+from saver import CSV_COLUMNS
+
+# Input features of the models, from the rename counts to the touched counts, and the label to predict
+METRICS = CSV_COLUMNS[CSV_COLUMNS.index('file_rename_count'):CSV_COLUMNS.index('method_fixes_sum')]
+LABEL = 'method_buggy'
+
+CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def read_header(path: str) -> List[str]:
+    if path.endswith('.parquet'):
+        import pyarrow.parquet
+        return pyarrow.parquet.read_schema(path).names
+    with open(path, 'r') as fin:
+        for line in fin:
+            if not line.lstrip().startswith('#'):
+                return line.strip().split(',')
+    return []
+
+
+def check_columns(path: str, names: List[str]) -> List[str]:
+    # Header of the dataset, which must contain all the names
+    header = read_header(path)
+    missing = [name for name in names if name not in header]
+    if len(missing) > 0:
+        print('Columns not found in {}: {}'.format(path, ', '.join(missing)))
+        exit(-1)
+    return header
+
+
+def split_chunks(path: str, chunk_size: int) -> List[Tuple[int, int]]:
+    # Byte ranges of about chunk_size bytes ending with a full line, the header excluded
+    chunks = []
+    size = os.path.getsize(path)
+    with open(path, 'rb') as fin:
+        line = fin.readline()
+        while line.lstrip().startswith(b'#'):
+            line = fin.readline()
+        start = fin.tell()
+        while start < size:
+            fin.seek(min(start + chunk_size, size))
+            fin.readline()
+            end = fin.tell()
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+
+def parse_chunk(args: Tuple[str, int, int, List[int]]) -> numpy.ndarray:
+    path, start, end, usecols = args
+    with open(path, 'rb') as fin:
+        fin.seek(start)
+        data = fin.read(end - start)
+    lines = data.splitlines(keepends=True)
+    if any(line.lstrip().startswith(b'#') for line in lines):
+        lines = [line for line in lines if not line.lstrip().startswith(b'#')]
+    # Keys and names never contain a comma and a # may be part of a file name, so comments are not searched inside the lines
+    return numpy.loadtxt(lines, delimiter=',', usecols=usecols, comments=None, dtype=numpy.float64, ndmin=2, encoding='utf-8')
+
+
+def load_csv(path: str, usecols: List[int], workers: int, chunk_size: int) -> numpy.ndarray:
+    tasks = [(path, start, end, usecols) for start, end in split_chunks(path, chunk_size)]
+    if len(tasks) == 0:
+        return numpy.empty((0, len(usecols)))
+    if workers > 1 and len(tasks) > 1:
+        with Pool(min(workers, len(tasks))) as pool:
+            parts = pool.map(parse_chunk, tasks)
+    else:
+        parts = [parse_chunk(task) for task in tasks]
+    return numpy.concatenate(parts)
+
+
+def iter_columns(path: str, names: List[str], chunk_size: int = CHUNK_SIZE) -> Iterator[numpy.ndarray]:
+    """
+    Yield the given columns of a CSV or Parquet dataset a chunk of about chunk_size bytes at a time, for datasets that do not fit in memory.
+    """
+    header = check_columns(path, names)
+
+    if path.endswith('.parquet'):
+        import pyarrow.parquet
+        rows = max(1, chunk_size // (8 * len(names)))
+        for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=rows, columns=names):
+            yield numpy.column_stack([batch.column(name).to_numpy().astype(numpy.float64) for name in names])
+    else:
+        usecols = [header.index(name) for name in names]
+        for start, end in split_chunks(path, chunk_size):
+            yield parse_chunk((path, start, end, usecols))
+
+
+def load_columns(path: str, names: List[str], workers: int = 1, chunk_size: int = CHUNK_SIZE, cache: bool = False) -> numpy.ndarray:
+    """
+    Load the given columns of a CSV or Parquet dataset in a float64 matrix, in the order of names.
+    A CSV file is parsed in chunks by a pool of workers, with cache the matrix is also saved in a .npy file next to the dataset and read from there until the dataset changes.
+    """
+    header = check_columns(path, names)
+
+    cache_path = '{}.{}.npy'.format(path, hashlib.sha1(','.join(names).encode()).hexdigest()[:12])
+    if cache and os.path.isfile(cache_path) and os.stat(cache_path).st_mtime_ns >= os.stat(path).st_mtime_ns:
+        print('Load cached dataset: ' + cache_path)
+        return numpy.load(cache_path, mmap_mode='r')
+
+    if path.endswith('.parquet'):
+        import pyarrow.parquet
+        # Typed columns, read without parsing
+        table = pyarrow.parquet.read_table(path, columns=names, memory_map=True)
+        dataset = numpy.column_stack([table.column(name).to_numpy().astype(numpy.float64) for name in names]) if table.num_rows > 0 else numpy.empty((0, len(names)))
+    else:
+        dataset = load_csv(path, [header.index(name) for name in names], workers, chunk_size)
+
+    if cache:
+        with write_aside(cache_path) as temp_path, open(temp_path, 'wb') as fout:
+            numpy.save(fout, dataset)
+    return dataset
@@ -0,0 +1,149 @@
+from collections import deque
+from itertools import islice
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+from method_metrics import MetricsBean
+
+
+class MethodHistories:
+    """
+    Histories of the methods still open during the mining, keyed by path$$method like a dict and in insertion order.
+    Entries are stored by file id and method name, a path points to its file id, so renaming a file moves a single pointer instead of every key.
+    """
+
+    def __init__(self, methods: Dict[str, List[MetricsBean]] = None):
+        self.histories = {}  # (file id, method name) -> List[MetricsBean]
+        self.file_ids = {}  # path -> file id
+        self.paths = {}  # file id -> path
+        self.names = {}  # file id -> Set[str] of the method names with an open history
+        self.next_id = 0
+        if methods is not None:
+            for key, history in methods.items():
+                self[key] = history
+
+    def split_key(self, key: str) -> Tuple[str, str]:
+        path, separator, name = key.partition('$$')
+        return path, name
+
+    def get_entry(self, key: str) -> Tuple[int, str]:
+        path, name = self.split_key(key)
+        return self.file_ids.get(path), name
+
+    def __len__(self) -> int:
+        return len(self.histories)
+
+    def __contains__(self, key: str) -> bool:
+        return self.get_entry(key) in self.histories
+
+    def __getitem__(self, key: str) -> List[MetricsBean]:
+        return self.histories[self.get_entry(key)]
+
+    def __setitem__(self, key: str, history: List[MetricsBean]):
+        path, name = self.split_key(key)
+        file_id = self.file_ids.get(path)
+        if file_id is None:
+            file_id = self.next_id
+            self.next_id += 1
+            self.file_ids[path] = file_id
+            self.paths[file_id] = path
+            self.names[file_id] = set()
+        self.names[file_id].add(name)
+        self.histories[(file_id, name)] = history
+
+    def get(self, key: str, default: List[MetricsBean] = None) -> List[MetricsBean]:
+        return self.histories.get(self.get_entry(key), default)
+
+    def setdefault(self, key: str, default: List[MetricsBean]) -> List[MetricsBean]:
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key: str, default: List[MetricsBean] = None) -> List[MetricsBean]:
+        entry = self.get_entry(key)
+        if entry not in self.histories:
+            return default
+        self.remove_name(*entry)
+        return self.histories.pop(entry)
+
+    def remove_name(self, file_id: int, name: str):
+        # A file without open histories is forgotten
+        names = self.names[file_id]
+        names.discard(name)
+        if len(names) == 0:
+            del self.names[file_id]
+            del self.file_ids[self.paths.pop(file_id)]
+
+    def keys(self) -> Iterator[str]:
+        for file_id, name in self.histories:
+            yield self.paths[file_id] + '$$' + name
+
+    def __iter__(self) -> Iterator[str]:
+        return self.keys()
+
+    def values(self) -> Iterator[List[MetricsBean]]:
+        return iter(self.histories.values())
+
+    def items(self) -> Iterator[Tuple[str, List[MetricsBean]]]:
+        for (file_id, name), history in self.histories.items():
+            yield self.paths[file_id] + '$$' + name, history
+
+    def rename(self, new_path: str, old_path: str):
+        """
+        Keys of new_path become keys of old_path, as when the old file is reached going back in the past.
+        """
+        file_id = self.file_ids.get(new_path)
+        if file_id is None or new_path == old_path:
+            return
+        if old_path not in self.file_ids:
+            del self.file_ids[new_path]
+            self.file_ids[old_path] = file_id
+            self.paths[file_id] = old_path
+        else:
+            self.merge_files(file_id, self.file_ids[old_path])
+
+    def merge_files(self, file_id: int, old_id: int):
+        # Both paths have open histories, the entries are rebuilt in order as a dict of the renamed keys: on a clash the later history wins
+        histories = {}
+        for (entry_id, name), history in self.histories.items():
+            histories[(old_id if entry_id == file_id else entry_id, name)] = history
+        self.histories = histories
+        self.names[old_id].update(self.names.pop(file_id))
+        del self.file_ids[self.paths.pop(file_id)]
+
+
+def append_bean(history: Deque[MetricsBean], bean: MetricsBean, window: Optional[int], horizon: Optional[int]):
+    """
+    Append an older bean to a history and drop the beans left outside the window whatever the next beans are, the most recent bean is always kept for the last values.
+    The Saver measures the window from the last bean of the history, this one or a bean of a later commit: horizon is the latest author date from this commit to the end of the walk.
+    Without a window or a horizon every bean is kept.
+    """
+    history.append(bean)
+    if window is None or horizon is None:
+        return
+    # Author dates are not ordered along the walk, only the beans too recent for any possible last bean are dropped
+    limit = max(bean.git_committer_timestamp, horizon) + window
+    if len(history) > 2 and history[1].git_committer_timestamp >= limit:
+        first = history.popleft()
+        while len(history) > 1 and history[0].git_committer_timestamp >= limit:
+            history.popleft()
+        history.appendleft(first)
+
+
+def join_histories(newer: Deque[MetricsBean], older: Deque[MetricsBean], window: Optional[int], horizon: Optional[int]) -> Deque[MetricsBean]:
+    # The older beans follow the newer ones, horizon bounds the author dates of the commits mined after the older ones
+    history = deque(newer)
+    history.extend(older)
+    if window is None or horizon is None or len(history) < 3:
+        return history
+    limit = max(history[-1].git_committer_timestamp, horizon) + window
+    return deque([history[0]] + [bean for bean in islice(history, 1, None) if bean.git_committer_timestamp < limit])
+
+
+def get_horizons(commits: List[Tuple[str, int]]) -> Dict[str, int]:
+    # Latest author timestamp from each commit to the end of the walk, the commits are in mining order
+    horizons = {}
+    horizon = None
+    for commit_hash, timestamp in reversed(commits):
+        horizon = timestamp if horizon is None else max(horizon, timestamp)
+        horizons[commit_hash] = horizon
+    return horizons
@@ -1,33 +1,48 @@
+from bisect import bisect_left, bisect_right
 from typing import List, Dict, Tuple
-import datetime
+import datetime, sys
+
+class DiffIndex:
+    """
+    Changed lines of a modification, sorted once and shared by all its methods: each method counts its lines with a binary search.
+    """
+
+    def __init__(self, lines: Dict[str, List[Tuple[int, str]]], source: str):
+        self.added = sorted(line for line, text in lines['added'])
+        self.deleted = sorted(line for line, text in lines['deleted'])
+        self.number_of_lines = source.count('\n') + 1 if source is not None else 0
+
+    def count_added(self, start: int, stop: int) -> int:
+        return bisect_right(self.added, stop) - bisect_left(self.added, start)
+
+    def count_deleted(self, start: int, stop: int) -> int:
+        return bisect_right(self.deleted, stop) - bisect_left(self.deleted, start)
+
+    def is_touched(self, start: int, stop: int) -> bool:
+        return self.count_added(start, stop) > 0 or self.count_deleted(start, stop) > 0
+
 
 class MethodMetrics():
 
-    def __init__(self, source: str, src_start: int, src_stop: int, lines: Dict[str, List[Tuple[int, str]]], buggy: bool, fix: bool):
+    def __init__(self, source: str, src_start: int, src_stop: int, diff_index: DiffIndex, buggy: bool, fix: bool):
         self.source = source
         self.src_start = src_start
         self.src_stop = src_stop
-        self.lines = lines
+        self.diff_index = diff_index
         self.buggy = buggy
         self.fix = fix
+        self.added_lines = diff_index.count_added(src_start, src_stop)
+        self.removed_lines = diff_index.count_deleted(src_start, src_stop)
 
     def get_method_source(self) -> str:
         src_lines = self.source.split('\n')
         return '\n'.join(src_lines[self.src_start - 1:self.src_stop])
 
     def get_number_of_lines(self) -> int:
-        return len(self.source.split('\n'))
+        return self.diff_index.number_of_lines
 
     def is_touched(self) -> bool:
-        added = self.lines['added']
-        deleted = self.lines['deleted']
-        for a_line, a_text in added:
-            if self.src_start <= a_line <= self.src_stop:
-                return True
-        for d_line, d_text in deleted:
-            if self.src_start <= d_line <= self.src_stop:
-                return True
-        return False
+        return self.added_lines > 0 or self.removed_lines > 0
 
     def is_buggy(self) -> bool:
         if self.buggy and self.is_touched():
@@ -40,23 +55,25 @@ class MethodMetrics():
         return False
 
     def get_added_lines(self) -> int:
-        count = 0
-        added = self.lines['added']
-        for a_line, a_text in added:
-            if self.src_start <= a_line <= self.src_stop:
-                count += 1
-        return count
+        return self.added_lines
 
     def get_removed_lines(self) -> int:
-        count = 0
-        deleted = self.lines['deleted']
-        for a_line, a_text in deleted:
-            if self.src_start <= a_line <= self.src_stop:
-                count += 1
-        return count
+        return self.removed_lines
+
+
+def intern(value):
+    # Hashes, paths, names and emails repeat across thousands of beans, keep a single copy of each
+    return sys.intern(value) if type(value) is str else value
 
 
 class MetricsBean:
+    # A bean is created for every method of every commit, slots avoid a __dict__ per instance
+    __slots__ = ('git_hash', 'git_committer_timestamp', 'file_name', 'method_name', 'method_start_line', 'change_type',
+                 'file_count', 'file_added', 'file_removed', 'file_nloc', 'file_comp', 'file_token_count', 'file_buggy', 'file_fix',
+                 'method_count', 'method_added', 'method_removed', 'method_nloc', 'method_comp', 'method_token',
+                 'method_number_of_lines', 'method_fan_in', 'method_fan_out', 'method_general_fan_out', 'method_parameters_count',
+                 'author_email', 'method_touched', 'method_fix', 'method_buggy')
+
     def __init__(self, git_hash: str, git_committer_date: datetime, file_name: str, method_name: str, method_start_line: int, change_type: str,
                  file_count: int, file_added: int, file_removed: int, file_nloc: int, file_comp: int, file_token_count: int,
                  method_count: int, method_added: int, method_removed: int, method_nlco: int, method_comp: int, method_token: int,
@@ -64,13 +81,12 @@ class MetricsBean:
                  method_number_of_lines: int, method_fan_in: int, method_fan_out: int, method_general_fan_out: int, method_parameters_count: int,
                  author_email: str,
                  method_touched: bool, method_fix: bool, method_buggy: bool):
-        self.git_hash = git_hash
-        self.git_committer_date = git_committer_date
-        self.file_name = file_name
-        self.method_name = method_name
+        self.git_hash = intern(git_hash)
+        self.git_committer_timestamp = int(git_committer_date.timestamp())  # GIT dates have a resolution of one second
+        self.file_name = intern(file_name)
+        self.method_name = intern(method_name)
         self.method_start_line = method_start_line
-        self.change_type = change_type
-
+        self.change_type = intern(change_type)
         self.file_count = file_count
         self.file_added = file_added
         self.file_removed = file_removed
@@ -93,7 +109,15 @@ class MetricsBean:
         self.method_general_fan_out = method_general_fan_out
         self.method_parameters_count = method_parameters_count
 
-        self.author_email = author_email
+        self.author_email = intern(author_email)
         self.method_touched = method_touched
         self.method_fix = method_fix
         self.method_buggy = method_buggy
+
+    def __getstate__(self):
+        # Positional state keeps checkpoints and shard results small
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, intern(value))
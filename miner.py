@@ -1,14 +1,29 @@
 import os
-from typing import List, Dict, Set
-from pydriller import RepositoryMining, GitRepository
-from pydriller.domain.commit import ModificationType
+from collections import deque
+from typing import Deque, List, Set, Optional, Tuple
+from pydriller import RepositoryMining, GitRepository, Commit
+from pydriller.domain.commit import ModificationType, Modification
 
-from method_metrics import MethodMetrics, MetricsBean
-from saver import Saver
+from analysis_cache import AnalysisCache, FileAnalysis
+from checkpoint import save_checkpoint, load_checkpoint
+from method_histories import MethodHistories, append_bean, get_horizons
+from method_metrics import DiffIndex, MethodMetrics, MetricsBean
+from saver import Saver, create_saver, WINDOW
+
+
+def clone_repository(gr: GitRepository, path: str) -> str:
+    """
+    Clone the repository in path sharing its objects, for a worker process to open on its own.
+    PyDriller writes the repository config every time it opens it, processes opening the same repository at once would collide.
+    """
+    gr.repo.git.clone('--quiet', '--shared', '--no-checkout', str(gr.path.resolve()), path)
+    return path
 
 
 class Miner:
-    def __init__(self, repo_path: str, allowed_extensions: List[str], csv_path: str, bic_commits: Set[str] = [str], fix_commits: Set[str] = [str]):
+    def __init__(self, repo_path: str, allowed_extensions: List[str], csv_path: str, bic_commits: Set[str] = [str], fix_commits: Set[str] = [str],
+                 checkpoint_path: str = None, checkpoint_interval: int = 500, cache_path: str = None, cache_size: int = 2 * 1024 * 1024 * 1024,
+                 batch_size: int = 100000, buffer_size: int = 4 * 1024 * 1024, output_format: str = 'csv', window: int = WINDOW):
         if repo_path is None:
             print('A local repository path must be specified')
             exit(-1)
@@ -18,16 +33,177 @@ class Miner:
             self.allowed_extensions = allowed_extensions
             self.bic_commits = bic_commits
             self.fix_commits = fix_commits
+            self.checkpoint_path = checkpoint_path
+            self.checkpoint_interval = checkpoint_interval
+            self.cache_path = cache_path
+            self.cache_size = cache_size
+            self.analysis_cache = None
+            self.diff_index = None  # (modification, DiffIndex) of the last modification analyzed
+            self.horizons = {}  # commit -> latest author timestamp from it to the end of the walk
+            self.batch_size = batch_size
+            self.buffer_size = buffer_size
+            self.output_format = output_format
+            self.window = window
         else:
             print('The following path does not exist: ' + repo_path)
             exit(-1)
 
-    def mine_methods(self, start_commit: str, stop_commit: str, filter_methods: Set[str] = None, filter_files: Set[str] = None) -> int:
-        methods = {}  # Dict[str, List[MinerBean]]
-        commits_to_analyze = -1
+    def mine_methods(self, start_commit: str, stop_commit: str, filter_methods: Set[str] = None, filter_files: Set[str] = None, resume: bool = False, saver: Saver = None) -> int:
+        methods = MethodHistories()  # path$$method -> List[MinerBean]
         print('Mining: ' + self.repo_path)
         gr = GitRepository(self.repo_path)
 
+        first_commit, last_commit = self.resolve_commits(gr, start_commit, stop_commit)
+
+        # Hashes and dates of the commits to analyze, the dates bound the beans still to come
+        print('Retrieve commits to analyze.')
+        commits = self.list_commits(gr, first_commit, last_commit)
+        self.horizons = get_horizons(commits)
+        commits_to_analyze = len(commits)
+        print('Commits to analyze: {}'.format(commits_to_analyze))
+
+        self.open_analysis_cache()
+
+        # Restore methods still open and the last mined commit of an interrupted run
+        checkpoint = None
+        if resume:
+            checkpoint = load_checkpoint(self.checkpoint_path) if self.checkpoint_path is not None else None
+            if checkpoint is None:
+                print('No checkpoint found, start from the first commit')
+            elif checkpoint['range'] != (first_commit, last_commit):
+                print('The checkpoint refers to a different range of commits: {}'.format(checkpoint['range']))
+                exit(-1)
+
+        # Open CSV file and write header
+        if saver is None:
+            saver = create_saver(self.csv_file, self.output_format, self.batch_size, self.buffer_size, self.window)
+        if checkpoint is not None:
+            # Rows written after the checkpoint belong to commits that will be mined again
+            saver.create_csv_file(truncate_at=checkpoint['output_size'])
+            # Histories of older checkpoints are lists
+            methods = MethodHistories({key: deque(history) for key, history in checkpoint['methods'].items()})
+            if filter_files is not None:
+                filter_files.update(checkpoint['filter_files'])
+            print('Resume after {} commits, the last one was {}'.format(checkpoint['commit_count'], checkpoint['commit']))
+        else:
+            saver.create_csv_file()
+            saver.print_csv_header()
+
+        # Traverse commits and calculate metrics
+        commit_count = 0
+        # for commit in RepositoryMining(self.repo_path, from_commit=first_commit, to_commit=last_commit, reversed_order=True, only_modifications_with_file_types=self.allowed_extensions).traverse_commits():
+        for commit in RepositoryMining(self.repo_path, from_commit=first_commit, to_commit=last_commit, reversed_order=True).traverse_commits():
+            # Skip commits already mined before the checkpoint, their modifications are never loaded
+            if checkpoint is not None:
+                commit_count += 1
+                if commit.hash == checkpoint['commit']:
+                    checkpoint = None
+                continue
+            methods, mod_analyzed_count = self.mine_commit(commit, methods, saver, filter_methods, filter_files)
+            saver.end_commit()
+            commit_count += 1
+            self.print_progress(methods, commit, commit_count, commits_to_analyze, mod_analyzed_count)
+            if self.checkpoint_path is not None and commit_count % self.checkpoint_interval == 0:
+                self.save_checkpoint(methods, saver, commit, commit_count, first_commit, last_commit, filter_files)
+        if checkpoint is not None:
+            print('The last commit of the checkpoint has not been found: ' + checkpoint['commit'])
+        saver.add_methods_to_csv(methods)
+        saver.close_csv_file()
+        self.close_analysis_cache()
+        print('Mining ended')
+        return commit_count
+
+    def open_analysis_cache(self):
+        if self.cache_path is not None:
+            self.analysis_cache = AnalysisCache(self.cache_path, self.cache_size)
+
+    def close_analysis_cache(self):
+        if self.analysis_cache is not None:
+            self.analysis_cache.close()
+            self.analysis_cache = None
+        # Release the last modification, with its source and parsed diff, at the end of every mining
+        self.diff_index = None
+
+    def analyze_modification(self, mod: Modification) -> FileAnalysis:
+        # Methods and file metrics calculated by Lizard, from the cache when the same blob has already been parsed
+        if self.analysis_cache is None:
+            return FileAnalysis(mod.methods, mod.nloc, mod.complexity, mod.token_count)
+        return self.analysis_cache.analyze(mod)
+
+    def mine_commit(self, commit: Commit, methods: MethodHistories, saver: Saver, filter_methods: Set[str] = None, filter_files: Set[str] = None) -> Tuple[MethodHistories, int]:
+        buggy = True if commit.hash in self.bic_commits else False
+        fix = True if commit.hash in self.fix_commits else False
+        mod_analyzed_count = 0
+        count_files_per_commit = len(commit.modifications)
+        for mod in commit.modifications:
+            # Filter out unnecessary files
+            if filter_files is None or mod.new_path in filter_files:
+                if mod.filename.endswith(tuple(self.allowed_extensions)):
+                    mod_analyzed_count += 1
+                    # Update key entry on rename
+                    if mod.change_type is ModificationType.RENAME:
+                        methods = self.update_keys(methods, mod.new_path, mod.old_path)
+                        if filter_files is not None:
+                            filter_files.add(mod.old_path)
+                    analysis = self.analyze_modification(mod)
+                    for method in analysis.methods:
+                        key = self.get_unique_key(mod.new_path, mod.old_path, method.name)
+                        # For unwanted keys prevent metric calculation
+                        if filter_methods is None or key in filter_methods:
+                            mb = self.create_bean(commit, mod, analysis, method, buggy, fix, count_files_per_commit)
+                            # Append new bean
+                            if key not in methods:
+                                methods[key] = self.new_history(key)
+                            append_bean(methods[key], mb, self.window, self.horizons.get(commit.hash))
+                            # Going back in the past ADD is the moment in which the a file, consequently a method, is added therefore it can be removed from the disc and flushed into the CSV to save RAM
+                            if mod.change_type is ModificationType.ADD:
+                                self.flush_methods(methods, key, saver)
+        return methods, mod_analyzed_count
+
+    def create_bean(self, commit: Commit, mod: Modification, analysis: FileAnalysis, method, buggy: bool, fix: bool, count_files_per_commit: int) -> MetricsBean:
+        count_methods_per_file = len(analysis.methods)
+        method_metrics = MethodMetrics(mod.source_code, method.start_line, method.end_line, self.get_diff_index(mod), buggy, fix)
+        m_touched = method_metrics.is_touched()
+        m_fix = method_metrics.is_fix()
+        m_buggy = method_metrics.is_buggy()
+        return MetricsBean(commit.hash, commit.author_date, mod.new_path, method.name, method.start_line, mod.change_type.name,
+                           count_files_per_commit, mod.added, mod.removed, analysis.nloc, analysis.complexity, analysis.token_count,
+                           count_methods_per_file, method_metrics.get_added_lines(), method_metrics.get_removed_lines(), method.nloc, method.complexity, method.token_count,
+                           buggy, fix,
+                           method_metrics.get_number_of_lines(), method.fan_in, method.fan_out, method.general_fan_out, len(method.parameters),
+                           commit.author.email,
+                           m_touched, m_fix, m_buggy)
+
+    def get_diff_index(self, mod: Modification) -> DiffIndex:
+        # PyDriller parses the diff at every access of diff_parsed, the index is built once for all the methods of the modification
+        if self.diff_index is None or self.diff_index[0] is not mod:
+            self.diff_index = (mod, DiffIndex(mod.diff_parsed, mod.source_code))
+        return self.diff_index[1]
+
+    def find_touched_methods(self, commit_hash: str) -> Tuple[Set[str], Set[str]]:
+        """
+        Keys and paths of the methods changed by a commit, found from its diff and the line ranges of its methods only.
+        """
+        gr = GitRepository(self.repo_path)
+        self.open_analysis_cache()
+        touched_methods, touched_files = self.get_touched_methods(gr.get_commit(commit_hash))
+        self.close_analysis_cache()
+        return touched_methods, touched_files
+
+    def get_touched_methods(self, commit: Commit) -> Tuple[Set[str], Set[str]]:
+        touched_methods = set()
+        touched_files = set()
+        for mod in commit.modifications:
+            if mod.filename.endswith(tuple(self.allowed_extensions)):
+                diff_index = self.get_diff_index(mod)
+                for method in self.analyze_modification(mod).methods:
+                    # Same test of MethodMetrics.is_touched
+                    if diff_index.is_touched(method.start_line, method.end_line):
+                        touched_methods.add(self.get_unique_key(mod.new_path, mod.old_path, method.name))
+                        touched_files.add(mod.new_path)
+        return touched_methods, touched_files
+
+    def resolve_commits(self, gr: GitRepository, start_commit: str, stop_commit: str) -> Tuple[str, str]:
         # Redefine start and stop commits
         print('Adjust start and stop commits.')
         first_commit = start_commit
@@ -40,71 +216,46 @@ class Miner:
         print('Start: {} Author date: {} Committer date: {}'.format(c1.hash, c1.author_date, c1.committer_date))
         c2 = gr.get_commit(last_commit)
         print('Stop:  {} Author date: {} Committer date: {}'.format(c2.hash, c2.author_date, c2.committer_date))
+        return first_commit, last_commit
 
-        # Unnecessary in production
-        # Count commits to analyze
-        print('Retrieve commits to analyze.')
+    def print_progress(self, methods: MethodHistories, commit: Commit, commit_count: int, commits_to_analyze: Optional[int], mod_analyzed_count: int):
+        buggy = True if commit.hash in self.bic_commits else False
+        fix = True if commit.hash in self.fix_commits else False
+        print('Methods: {:>8} | Commit {:>6}/{:<6} {} Date: {} Mods: {:>4}/{:<4} | Bug: {} Fix: {}'.format(len(methods), commit_count, commits_to_analyze or '?', commit.hash, commit.author_date.strftime('%d/%m/%Y'),
+                                                                                                           len(commit.modifications), mod_analyzed_count, buggy, fix))
+
+    def list_commits(self, gr: GitRepository, first_commit: str, last_commit: str) -> List[Tuple[str, int]]:
+        """
+        Hashes and author timestamps of the commits RepositoryMining walks with reversed_order=True, from the newest to the oldest.
+        As PyDriller does, the log of HEAD is sliced by position from the first commit to the last one (included), swapped when the first is older.
+        """
+        first = gr.get_commit(first_commit)
+        last = gr.get_commit(last_commit) if last_commit is not None else None
+        if last is not None and first.committer_date < last.committer_date:
+            first, last = last, first
         commits = []
-        for commit in RepositoryMining(self.repo_path, from_commit=first_commit, to_commit=last_commit, reversed_order=True).traverse_commits():
-            commits.append(commit)
-            print('{}) {} {}'.format(len(commits), commit.hash, commit.author_date))
-        commits_to_analyze = len(commits)
+        # Streamed, the commits older than the range are never read
+        proc = gr.repo.git.log('--format=%H %at', 'HEAD', as_process=True)
+        for line in proc.stdout:
+            commit_hash, timestamp = line.decode().split()
+            if commits or commit_hash == first.hash:
+                commits.append((commit_hash, int(timestamp)))
+                if last is not None and commit_hash == last.hash:
+                    break
+        proc.proc.kill()
+        proc.proc.wait()
+        return commits
 
-        # Open CSV file and write header
-        saver = Saver(self.csv_file)
-        saver.create_csv_file()
-        saver.print_csv_header()
-
-        # Traverse commits and calculate metrics
-        commit_count = 0
-        # for commit in RepositoryMining(self.repo_path, from_commit=first_commit, to_commit=last_commit, reversed_order=True, only_modifications_with_file_types=self.allowed_extensions).traverse_commits():
-        for commit in RepositoryMining(self.repo_path, from_commit=first_commit, to_commit=last_commit, reversed_order=True).traverse_commits():
-            buggy = True if commit.hash in self.bic_commits else False
-            fix = True if commit.hash in self.fix_commits else False
-            mod_analyzed_count = 0
-            count_files_per_commit = len(commit.modifications)
-            for mod in commit.modifications:
-                # Filter out unnecessary files
-                if filter_files is None or mod.new_path in filter_files:
-                    if mod.filename.endswith(tuple(self.allowed_extensions)):
-                        mod_analyzed_count += 1
-                        # Update key entry on rename
-                        if mod.change_type is ModificationType.RENAME:
-                            methods = self.update_keys(methods, mod.new_path, mod.old_path)
-                            if filter_files is not None:
-                                filter_files.add(mod.old_path)
-                        count_methods_per_file = len(mod.methods)
-                        for method in mod.methods:
-                            key = self.get_unique_key(mod.new_path, mod.old_path, method.name)
-                            # For unwanted keys prevent metric calculation
-                            if filter_methods is None or key in filter_methods:
-                                lines = mod.diff_parsed
-                                method_metrics = MethodMetrics(mod.source_code, method.start_line, method.end_line, lines, buggy, fix)
-                                m_touched = method_metrics.is_touched()
-                                m_fix = method_metrics.is_fix()
-                                m_buggy = method_metrics.is_buggy()
-                                mb = MetricsBean(commit.hash, commit.author_date, mod.new_path, method.name, method.start_line, mod.change_type.name,
-                                                 count_files_per_commit, mod.added, mod.removed, mod.nloc, mod.complexity, mod.token_count,
-                                                 count_methods_per_file, method_metrics.get_added_lines(), method_metrics.get_removed_lines(), method.nloc, method.complexity, method.token_count,
-                                                 buggy, fix,
-                                                 method_metrics.get_number_of_lines(), method.fan_in, method.fan_out, method.general_fan_out, len(method.parameters),
-                                                 commit.author.email,
-                                                 m_touched, m_fix, m_buggy)
-                                # Append new bean
-                                if key not in methods:
-                                    methods[key] = []
-                                methods.get(key, []).append(mb)
-                                # Going back in the past ADD is the moment in which the a file, consequently a method, is added therefore it can be removed from the disc and flushed into the CSV to save RAM
-                                if mod.change_type is ModificationType.ADD:
-                                    self.flush_methods(methods, key, saver)
-            commit_count += 1
-            print('Methods: {:>8} | Commit {:>6}/{:<6} {} Date: {} Mods: {:>4}/{:<4} | Bug: {} Fix: {}'.format(len(methods), commit_count, commits_to_analyze, commit.hash, commit.author_date.strftime('%d/%m/%Y'),
-                                                                                                               len(commit.modifications), mod_analyzed_count, buggy, fix))
-        for key, value in methods.items():
-            saver.add_method_to_csv(key, value)
-        saver.close_csv_file()
-        print('Mining ended')
-        return commit_count
+    def save_checkpoint(self, methods: MethodHistories, saver: Saver, commit: Commit, commit_count: int, first_commit: str, last_commit: str, filter_files: Set[str]):
+        # Rows of the methods already flushed must be on disk before the checkpoint that drops them
+        output_size = saver.sync()
+        save_checkpoint(self.checkpoint_path, {'range': (first_commit, last_commit),
+                                               'commit': commit.hash,
+                                               'commit_count': commit_count,
+                                               'output_size': output_size,
+                                               'filter_files': filter_files,
+                                               'methods': methods})
+        print('Checkpoint saved: {}'.format(self.checkpoint_path))
 
     def get_unique_key(self, new_path: str, old_path: str, method_name: str) -> str:
         if new_path is not None and new_path is not '':
@@ -115,20 +266,18 @@ class Miner:
             key = 'unexpected_key'
         return key
 
-    def update_keys(self, methods: Dict[str, List[MetricsBean]], new_path: str, old_path: str) -> Dict[str, List[MetricsBean]]:
-        new_methods = {}
-        for key, value in methods.items():
-            old_key_path, method_name = key.split('$$')
-            if old_key_path == new_path:
-                key = old_path + '$$' + method_name
-            new_methods[key] = value
-        methods.clear()  # Reduce here Python garbage collector pressure
-        del methods
-        return new_methods
-
-    def flush_methods(self, methods: Dict[str, List[MetricsBean]], key: str, saver: Saver):
+    def new_history(self, key: str) -> Deque[MetricsBean]:
+        return deque()
+
+    def update_keys(self, methods: MethodHistories, new_path: str, old_path: str) -> MethodHistories:
+        # Only the methods of the renamed file are touched
+        methods.rename(new_path, old_path)
+        return methods
+
+    def flush_methods(self, methods: MethodHistories, key: str, saver: Saver):
         m = methods.pop(key, None)
         if m is not None:
             saver.add_method_to_csv(key, m)
         else:
             print('Unexpected key entry: ' + key)
+
@@ -0,0 +1,31 @@
+from typing import Dict, List
+
+import joblib, numpy
+
+# Increased when the content of the bundle changes
+BUNDLE_VERSION = 1
+
+
+def save_bundle(path: str, model, scaler, features: List[str]):
+    # The model with what is needed to prepare its input: the names of the features and the standardization fitted on the training set
+    joblib.dump({'version': BUNDLE_VERSION,
+                 'model': model,
+                 'features': list(features),
+                 'mean': scaler.mean_,
+                 'scale': scaler.scale_}, path)
+
+
+def load_bundle(path: str) -> Dict:
+    bundle = joblib.load(path)
+    if not isinstance(bundle, dict):
+        # A bare model saved before the bundles, its input must be standardized at predict time
+        return {'version': 0, 'model': bundle, 'features': None, 'mean': None, 'scale': None}
+    if bundle.get('version', 0) > BUNDLE_VERSION:
+        print('The model bundle {} has version {}, the newest supported is {}'.format(path, bundle['version'], BUNDLE_VERSION))
+        exit(-1)
+    return bundle
+
+
+def standardize(bundle: Dict, x: numpy.ndarray) -> numpy.ndarray:
+    # Same transformation of StandardScaler.transform
+    return (x - bundle['mean']) / bundle['scale']
@@ -1,283 +1,325 @@
-import statistics as st
-from typing import List
+import os
+from itertools import chain, compress
+from operator import attrgetter
+from typing import List, Dict, Set, Tuple
+
+import numpy
 
 from method_metrics import MetricsBean
 
+CSV_HEADER = 'key,git_hash,file_name,method_name,method_start_line,file_rename_count,method_rename_count,change_type_count,' \
+ \
+             'file_count_last,file_count_max,file_count_mean,file_count_sum,' \
+             'file_added_last,file_added_max,file_added_mean,file_added_sum,' \
+             'file_removed_last,file_removed_max,file_removed_mean,file_removed_sum,' \
+             'file_nloc_last,file_nloc_max,file_nloc_mean,file_nloc_sum,' \
+             'file_comp_last,file_comp_max,file_comp_mean,file_comp_sum,' \
+             'file_token_count_last,file_token_count_max,file_token_count_mean,file_token_count_sum,' \
+ \
+             'method_count_last,method_count_max,method_count_mean,method_count_sum,' \
+             'method_added_last,method_added_max,method_added_mean,method_added_sum,' \
+             'method_removed_last,method_removed_max,method_removed_mean,method_removed_sum,' \
+             'method_nloc_last,method_nloc_max,method_nloc_mean,method_nloc_sum,' \
+             'method_comp_last,method_comp_max,method_comp_mean,method_comp_sum,' \
+             'method_token_last,method_token_max,method_token_mean,method_token_sum,' \
+             'method_method_number_of_line_last,method_method_number_of_line_max,method_method_number_of_line_mean,method_method_number_of_line_sum,' \
+             'method_fan_in_last,method_fan_in_max,method_fan_in_mean,method_fan_in_sum,' \
+             'method_fan_out_last,method_fan_out_max,method_fan_out_mean,method_fan_out_sum,' \
+             'method_general_fan_out_last,method_general_fan_out_max,method_general_fan_out_mean,method_general_fan_out_sum,' \
+             'method_parameters_counts_last,method_parameters_counts_max,method_parameters_counts_mean,method_parameters_counts_sum,' \
+ \
+             'author_email_mean,author_email_sum,' \
+             'method_touched_sum,method_touched_mean,method_fixes_sum,method_fixes_mean,' \
+ \
+             'file_buggy,file_fix,method_bug_sum,method_bug_mean,method_fix,method_buggy\n'
+CSV_COLUMNS = CSV_HEADER.strip().split(',')
+
+# Bean attributes aggregated as last, max, mean and sum, in the order of the CSV columns
+FEATURES = ['file_count', 'file_added', 'file_removed', 'file_nloc', 'file_comp', 'file_token_count',
+            'method_count', 'method_added', 'method_removed', 'method_nloc', 'method_comp', 'method_token',
+            'method_number_of_lines', 'method_fan_in', 'method_fan_out', 'method_general_fan_out', 'method_parameters_count']
+# Numeric bean attributes loaded in a single matrix, the features first
+NUMERIC = FEATURES + ['method_touched', 'method_fix', 'method_buggy', 'file_buggy', 'file_fix', 'method_start_line', 'git_committer_timestamp']
+COLUMN = {name: i for i, name in enumerate(NUMERIC)}
+# CSV names of the aggregated features, slightly different from the bean attributes
+FEATURE_COLUMNS = [name[:-len('_last')] for name in CSV_COLUMNS[8:8 + 4 * len(FEATURES):4]]
+FEATURE_MEANS = {name + '_mean' for name in FEATURE_COLUMNS}
+# Attributes whose distinct values are counted
+DISTINCT = ['file_name', 'method_name', 'change_type', 'author_email']
+
+WINDOW = 10368000  # Default window of the aggregates: 4 months, in seconds
+
+OUTPUT_FORMATS = ['csv', 'parquet']
+# Types of the columns of the Parquet output, means are the only real numbers
+STRING_COLUMNS = CSV_COLUMNS[:4]
+FLOAT_COLUMNS = [name for name in CSV_COLUMNS if name.endswith('_mean')]
+
+
+def get_numeric_values(beans: List[MetricsBean]) -> numpy.ndarray:
+    values = numpy.fromiter(chain.from_iterable(map(attrgetter(*NUMERIC), beans)), dtype=numpy.int64, count=len(beans) * len(NUMERIC))
+    return values.reshape(len(beans), len(NUMERIC))
+
+
+def aggregate_methods(methods: List[Tuple[str, List[MetricsBean]]], window: int = WINDOW) -> Tuple[Dict[str, numpy.ndarray], int]:
+    """
+    Aggregate the histories of many methods at once, each one ordered from the most recent bean.
+    Return the CSV columns (means as float64) and the number of beans outside the window, in seconds from the oldest bean of their method.
+    """
+    lengths = numpy.fromiter((len(method) for key, method in methods), dtype=numpy.int64, count=len(methods))
+    starts = numpy.concatenate(([0], numpy.cumsum(lengths)[:-1]))
+    ends = starts + lengths - 1
+    beans = [bean for key, method in methods for bean in method]
+    segments = numpy.repeat(numpy.arange(len(methods)), lengths)
+
+    # Keep the beans close to the oldest one of their method
+    timestamps = numpy.fromiter(map(attrgetter('git_committer_timestamp'), beans), dtype=numpy.int64, count=len(beans))
+    window = numpy.abs(timestamps - timestamps[ends][segments]) < window
+    kept_beans = list(compress(beans, window.tolist()))
+    discarded = len(beans) - len(kept_beans)
+    kept = get_numeric_values(kept_beans)
+    kept_segments = segments[window]
+    kept_lengths = numpy.bincount(kept_segments, minlength=len(methods))
+    kept_starts = numpy.concatenate(([0], numpy.cumsum(kept_lengths)[:-1]))
+
+    columns = {}
+    beans_first = [method[0] for key, method in methods]
+    first = get_numeric_values(beans_first)
+    columns['key'] = [key.replace(',', '-comma-') for key, method in methods]
+    columns['git_hash'] = [bean.git_hash for bean in beans_first]
+    columns['file_name'] = [bean.file_name.replace(',', '-comma-') for bean in beans_first]
+    columns['method_name'] = [bean.method_name.replace(',', '-comma-') for bean in beans_first]
+    columns['method_start_line'] = first[:, COLUMN['method_start_line']]
+
+    # Distinct values per method, the (method, value) pairs are counted once
+    # MetricsBean interns its strings, so equal values are the same object and can be compared by id
+    distinct = {}
+    for name in DISTINCT:
+        ids = numpy.fromiter(map(id, map(attrgetter(name), kept_beans)), dtype=numpy.uint64, count=len(kept_beans))
+        values, codes = numpy.unique(ids, return_inverse=True)
+        pairs = numpy.unique(kept_segments * len(values) + codes.reshape(-1))
+        distinct[name] = numpy.bincount(pairs // len(values), minlength=len(methods))
+    columns['file_rename_count'] = distinct['file_name']
+    columns['method_rename_count'] = distinct['method_name']
+    columns['change_type_count'] = distinct['change_type']
+
+    sums = numpy.add.reduceat(kept, kept_starts, axis=0)
+    maxs = numpy.maximum.reduceat(kept, kept_starts, axis=0)
+    for feature, prefix in zip(FEATURES, FEATURE_COLUMNS):
+        columns[prefix + '_last'] = first[:, COLUMN[feature]]
+        columns[prefix + '_max'] = maxs[:, COLUMN[feature]]
+        columns[prefix + '_mean'] = sums[:, COLUMN[feature]] / kept_lengths
+        columns[prefix + '_sum'] = sums[:, COLUMN[feature]]
+
+    columns['author_email_mean'] = distinct['author_email'] / kept_lengths
+    columns['author_email_sum'] = distinct['author_email']
+    columns['method_touched_sum'] = sums[:, COLUMN['method_touched']]
+    columns['method_touched_mean'] = sums[:, COLUMN['method_touched']] / kept_lengths
+    columns['method_fixes_sum'] = sums[:, COLUMN['method_fix']]
+    columns['method_fixes_mean'] = sums[:, COLUMN['method_fix']] / kept_lengths
+    columns['file_buggy'] = first[:, COLUMN['file_buggy']]
+    columns['file_fix'] = first[:, COLUMN['file_fix']]
+    columns['method_bug_sum'] = sums[:, COLUMN['method_buggy']]
+    columns['method_bug_mean'] = sums[:, COLUMN['method_buggy']] / kept_lengths
+    columns['method_fix'] = first[:, COLUMN['method_fix']]
+    columns['method_buggy'] = first[:, COLUMN['method_buggy']]
+    return columns, discarded
+
+
+def format_csv_rows(columns: Dict[str, numpy.ndarray]) -> str:
+    cells = []
+    for name in CSV_COLUMNS:
+        column = columns[name]
+        if name in FEATURE_MEANS:
+            # statistics.mean of integers is an integer when the division has no remainder
+            cell = column.astype(object)
+            integers = column == numpy.floor(column)
+            cell[integers] = column[integers].astype(numpy.int64).astype(object)
+            column = cell
+        cells.append(column.tolist() if isinstance(column, numpy.ndarray) else column)
+    row_format = ','.join(['{}'] * len(CSV_COLUMNS)) + '\n'
+    return ''.join([row_format.format(*row) for row in zip(*cells)])
+
 
 class Saver:
 
-    def __init__(self, filename: str):
+    def __init__(self, filename: str, batch_size: int = 100000, buffer_size: int = 4 * 1024 * 1024, window: int = WINDOW):
         self.filename = filename
-
-    def create_csv_file(self):
-        self.out_file = open(self.filename, 'w')
+        self.window = window
+        # Methods are aggregated together once batch_size beans are pending
+        self.batch_size = batch_size
+        self.pending = []
+        self.pending_beans = 0
+        # Aggregated rows are written to the file once buffer_size characters are buffered, at the end of a commit
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.buffer_bytes = 0
+
+    def create_csv_file(self, truncate_at: int = None):
+        if truncate_at is not None:
+            # Resume a previous file dropping what was written after the given size
+            os.truncate(self.filename, truncate_at)
+            self.out_file = open(self.filename, 'a')
+        else:
+            self.out_file = open(self.filename, 'w')
 
     def print_csv_header(self):
-        header = 'key,git_hash,file_name,method_name,method_start_line,file_rename_count,method_rename_count,change_type_count,' \
- \
-                 'file_count_last,file_count_max,file_count_mean,file_count_sum,' \
-                 'file_added_last,file_added_max,file_added_mean,file_added_sum,' \
-                 'file_removed_last,file_removed_max,file_removed_mean,file_removed_sum,' \
-                 'file_nloc_last,file_nloc_max,file_nloc_mean,file_nloc_sum,' \
-                 'file_comp_last,file_comp_max,file_comp_mean,file_comp_sum,' \
-                 'file_token_count_last,file_token_count_max,file_token_count_mean,file_token_count_sum,' \
- \
-                 'method_count_last,method_count_max,method_count_mean,method_count_sum,' \
-                 'method_added_last,method_added_max,method_added_mean,method_added_sum,' \
-                 'method_removed_last,method_removed_max,method_removed_mean,method_removed_sum,' \
-                 'method_nloc_last,method_nloc_max,method_nloc_mean,method_nloc_sum,' \
-                 'method_comp_last,method_comp_max,method_comp_mean,method_comp_sum,' \
-                 'method_token_last,method_token_max,method_token_mean,method_token_sum,' \
-                 'method_method_number_of_line_last,method_method_number_of_line_max,method_method_number_of_line_mean,method_method_number_of_line_sum,' \
-                 'method_fan_in_last,method_fan_in_max,method_fan_in_mean,method_fan_in_sum,' \
-                 'method_fan_out_last,method_fan_out_max,method_fan_out_mean,method_fan_out_sum,' \
-                 'method_general_fan_out_last,method_general_fan_out_max,method_general_fan_out_mean,method_general_fan_out_sum,' \
-                 'method_parameters_counts_last,method_parameters_counts_max,method_parameters_counts_mean,method_parameters_counts_sum,' \
- \
-                 'author_email_mean,author_email_sum,' \
-                 'method_touched_sum,method_touched_mean,method_fixes_sum,method_fixes_mean,' \
- \
-                 'file_buggy,file_fix,method_bug_sum,method_bug_mean,method_fix,method_buggy\n'
-        # print('Header count: {}'.format(header.count(',')))
-        self.out_file.write(header)
+        # print('Header count: {}'.format(CSV_HEADER.count(',')))
+        self.out_file.write(CSV_HEADER)
 
     def add_method_to_csv(self, key: str, method: List[MetricsBean]):
+        self.pending.append((key, method))
+        self.pending_beans += len(method)
+        if self.pending_beans >= self.batch_size:
+            self.write_pending()
+
+    def add_methods_to_csv(self, methods: Dict[str, List[MetricsBean]]):
+        for key, method in methods.items():
+            self.add_method_to_csv(key, method)
+
+    def copy_rows(self, path: str, skip_keys: Set[str]):
+        # Rows of a previous output file in the same format, except the ones of the given methods
+        self.write_pending()
+        self.write_buffer()
+        skip_keys = set(key.replace(',', '-comma-') for key in skip_keys)
+        with open(path, 'r') as fin:
+            fin.readline()  # Header
+            for line in fin:
+                if line[:line.index(',')] not in skip_keys:
+                    self.out_file.write(line)
+
+    def write_pending(self):
+        if self.pending:
+            # Most of the beans outside the window are already dropped by the miner, the others are left out here
+            columns, discarded = aggregate_methods(self.pending, self.window)
+            rows, size = self.encode_rows(columns)
+            self.buffer.append(rows)
+            self.buffer_bytes += size
+            self.pending = []
+            self.pending_beans = 0
+
+    def encode_rows(self, columns: Dict[str, numpy.ndarray]) -> Tuple[str, int]:
+        rows = format_csv_rows(columns)
+        return rows, len(rows)
+
+    def write_buffer(self):
+        if self.buffer:
+            self.out_file.write(''.join(self.buffer))
+            self.out_file.flush()
+            self.buffer = []
+            self.buffer_bytes = 0
+
+    def end_commit(self):
+        # Called between two commits, the file never holds only a part of the rows flushed by a commit
+        if self.buffer_bytes >= self.buffer_size:
+            self.write_buffer()
+
+    def sync(self) -> int:
+        # Force rows written so far on disk and return the size of the file
+        self.write_pending()
+        self.write_buffer()
+        os.fsync(self.out_file.fileno())
+        return os.fstat(self.out_file.fileno()).st_size
+
+    def close_csv_file(self):
+        self.write_pending()
+        self.write_buffer()
+        self.out_file.close()
+
 
-        # git_hashs = []
-        file_names = []
-        method_names = []
-        method_start_lines = []
-        change_types = []
-        file_counts = []
-        file_addeds = []
-        file_removeds = []
-        file_nlocs = []
-        file_comps = []
-        file_token_counts = []
-        method_counts = []
-        method_addeds = []
-        method_removeds = []
-        method_nlcos = []
-        method_comps = []
-        method_tokens = []
-        method_number_of_lines = []
-        method_fan_ins = []
-        method_fan_outs = []
-        method_general_fan_outs = []
-        method_parameters_counts = []
-        author_emails = []
-        touches = []
-        fixes = []
-        buggys = []
-
-        # Identifiers
-        git_hash = method[0].git_hash
-        file_name = method[0].file_name
-        file_buggy = method[0].file_buggy
-        file_fix = method[0].file_fix
-        method_name = method[0].method_name
-        method_start_line = method[0].method_start_line
-        method_touched = method[0].method_touched
-        method_fix = method[0].method_fix
-        method_buggy = method[0].method_buggy
-
-        # List of process metrics
-        for n in range(0, len(method)):
-            start_time = method[n].git_committer_date
-            stop_time = method[len(method) - 1].git_committer_date
-            diff_time = abs(start_time - stop_time)
-            if diff_time.total_seconds() < 10368000:  # Reduce analysis to 4 Months only
-                # git_hashs.append(method[n].git_hash)
-                file_names.append(method[n].file_name)
-                method_names.append(method[n].method_name)
-                change_types.append(method[n].change_type)
-                file_counts.append(method[n].file_count)
-                file_addeds.append(method[n].file_added)
-                file_removeds.append(method[n].file_removed)
-                file_nlocs.append(method[n].file_nloc)
-                file_comps.append(method[n].file_comp)
-                file_token_counts.append(method[n].file_token_count)
-                # Method
-                method_counts.append(method[n].method_count)
-                method_addeds.append(method[n].method_added)
-                method_removeds.append(method[n].method_removed)
-                method_nlcos.append(method[n].method_nloc)
-                method_comps.append(method[n].method_comp)
-                method_tokens.append(method[n].method_token)
-                method_number_of_lines.append(method[n].method_number_of_lines)
-                method_fan_ins.append(method[n].method_fan_in)
-                method_fan_outs.append(method[n].method_fan_out)
-                method_general_fan_outs.append(method[n].method_general_fan_out)
-                method_parameters_counts.append(method[n].method_parameters_count)
-                author_emails.append(method[n].author_email)
-
-                touches.append(int(method[n].method_touched))
-                fixes.append(int(method[n].method_fix))
-                buggys.append(int(method[n].method_buggy))
+class ParquetSaver(Saver):
+    """
+    Saves the same columns of the CSV file in a Parquet file with typed columns, every write of the buffer is a row group.
+    A Parquet file is readable only once closed, so it cannot be resumed from a checkpoint.
+    """
+
+    def create_csv_file(self, truncate_at: int = None):
+        import pyarrow, pyarrow.parquet
+        if truncate_at is not None:
+            print('A Parquet output cannot be resumed')
+            exit(-1)
+        fields = []
+        for name in CSV_COLUMNS:
+            if name in STRING_COLUMNS:
+                fields.append(pyarrow.field(name, pyarrow.string()))
+            elif name in FLOAT_COLUMNS:
+                fields.append(pyarrow.field(name, pyarrow.float64()))
             else:
-                print("Discarded!!!!")
-
-        # Other process metrics
-        file_rename_count = len(set(file_names))
-        method_rename_count = len(set(method_names))
-        change_type_count = len(set(change_types))
-
-        # File metrics
-        file_count_last = method[0].file_count
-        file_count_max = max(file_counts)
-        file_count_mean = st.mean(file_counts)
-        file_count_sum = sum(file_counts)
-
-        file_added_last = method[0].file_added
-        file_added_max = max(file_addeds)
-        file_added_mean = st.mean(file_addeds)
-        file_added_sum = sum(file_addeds)
-
-        file_removed_last = method[0].file_removed
-        file_removed_max = max(file_removeds)
-        file_removed_mean = st.mean(file_removeds)
-        file_removed_sum = sum(file_removeds)
-
-        file_nloc_last = method[0].file_nloc
-        file_nloc_max = max(file_nlocs)
-        file_nloc_mean = st.mean(file_nlocs)
-        file_nloc_sum = sum(file_nlocs)
-
-        file_comp_last = method[0].file_comp
-        file_comp_max = max(file_comps)
-        file_comp_mean = st.mean(file_comps)
-        file_comp_sum = sum(file_comps)
-
-        file_token_count_last = method[0].file_token_count
-        file_token_count_max = max(file_token_counts)
-        file_token_count_mean = st.mean(file_token_counts)
-        file_token_count_sum = sum(file_token_counts)
-
-        # Methods metrics
-        method_count_last = method[0].method_count
-        method_count_max = max(method_counts)
-        method_count_mean = st.mean(method_counts)
-        method_count_sum = sum(method_counts)
-
-        method_added_last = method[0].method_added
-        method_added_max = max(method_addeds)
-        method_added_mean = st.mean(method_addeds)
-        method_added_sum = sum(method_addeds)
-
-        method_removed_last = method[0].method_removed
-        method_removed_max = max(method_removeds)
-        method_removed_mean = st.mean(method_removeds)
-        method_removed_sum = sum(method_removeds)
-
-        method_nloc_last = method[0].method_nloc
-        method_nloc_max = max(method_nlcos)
-        method_nloc_mean = st.mean(method_nlcos)
-        method_nloc_sum = sum(method_nlcos)
-
-        method_comp_last = method[0].method_comp
-        method_comp_max = max(method_comps)
-        method_comp_mean = st.mean(method_comps)
-        method_comp_sum = sum(method_comps)
-
-        method_token_last = method[0].method_token
-        method_token_max = max(method_tokens)
-        method_token_mean = st.mean(method_tokens)
-        method_token_sum = sum(method_tokens)
-
-        method_method_number_of_line_last = method[0].method_number_of_lines
-        method_method_number_of_line_max = max(method_number_of_lines)
-        method_method_number_of_line_mean = st.mean(method_number_of_lines)
-        method_method_number_of_line_sum = sum(method_number_of_lines)
-
-        method_fan_in_last = method[0].method_fan_in
-        method_fan_in_max = max(method_fan_ins)
-        method_fan_in_mean = st.mean(method_fan_ins)
-        method_fan_in_sum = sum(method_fan_ins)
-
-        method_fan_out_last = method[0].method_fan_out
-        method_fan_out_max = max(method_fan_outs)
-        method_fan_out_mean = st.mean(method_fan_outs)
-        method_fan_out_sum = sum(method_fan_outs)
-
-        method_general_fan_out_last = method[0].method_general_fan_out
-        method_general_fan_out_max = max(method_general_fan_outs)
-        method_general_fan_out_mean = st.mean(method_general_fan_outs)
-        method_general_fan_out_sum = sum(method_general_fan_outs)
-
-        method_parameters_counts_last = method[0].method_parameters_count
-        method_parameters_counts_max = max(method_parameters_counts)
-        method_parameters_counts_mean = st.mean(method_parameters_counts)
-        method_parameters_counts_sum = sum(method_parameters_counts)
-
-        author_email_last = len(set(author_emails)) / len(author_emails)
-        author_email_sum = len(set(author_emails))
-
-        method_touched_last = touches[0]
-        method_touched_sum = sum(touches)
-        method_touched_mean = sum(touches) / len(touches)
-
-        method_fixes_sum = sum(fixes)
-        method_fixes_mean = sum(fixes) / len(fixes)
-
-        method_buggy_sum = sum(buggys)
-        method_buggy_mean = sum(buggys) / len(buggys)
-
-        # Append process metrics to CSV file
-        out_string = '{},{},{},{},{},{},{},{},' \
- \
-                     '{},{},{},{},' \
-                     '{},{},{},{},' \
-                     '{},{},{},{},' \
-                     '{},{},{},{},' \
-                     '{},{},{},{},' \
-                     '{},{},{},{},' \
- \
-                     '{},{},{},{},' \
-                     '{},{},{},{},' \
-                     '{},{},{},{},' \
-                     '{},{},{},{},' \
-                     '{},{},{},{},' \
-                     '{},{},{},{},' \
-                     '{},{},{},{},' \
-                     '{},{},{},{},' \
-                     '{},{},{},{},' \
-                     '{},{},{},{},' \
-                     '{},{},{},{},' \
- \
-                     '{},{},' \
-                     '{},{},{},{},' \
- \
-                     '{},{},{},{},{},{}\n'.format(
-            key.replace(',', '-comma-'), git_hash, file_name.replace(',', '-comma-'), method_name.replace(',', '-comma-'), method_start_line, file_rename_count, method_rename_count, change_type_count,
-
-            file_count_last, file_count_max, file_count_mean, file_count_sum,
-            file_added_last, file_added_max, file_added_mean, file_added_sum,
-            file_removed_last, file_removed_max, file_removed_mean, file_removed_sum,
-            file_nloc_last, file_nloc_max, file_nloc_mean, file_nloc_sum,
-            file_comp_last, file_comp_max, file_comp_mean, file_comp_sum,
-            file_token_count_last, file_token_count_max, file_token_count_mean, file_token_count_sum,
-
-            method_count_last, method_count_max, method_count_mean, method_count_sum,
-            method_added_last, method_added_max, method_added_mean, method_added_sum,
-            method_removed_last, method_removed_max, method_removed_mean, method_removed_sum,
-            method_nloc_last, method_nloc_max, method_nloc_mean, method_nloc_sum,
-            method_comp_last, method_comp_max, method_comp_mean, method_comp_sum,
-            method_token_last, method_token_max, method_token_mean, method_token_sum,
-            method_method_number_of_line_last, method_method_number_of_line_max, method_method_number_of_line_mean, method_method_number_of_line_sum,
-            method_fan_in_last, method_fan_in_max, method_fan_in_mean, method_fan_in_sum,
-            method_fan_out_last, method_fan_out_max, method_fan_out_mean, method_fan_out_sum,
-            method_general_fan_out_last, method_general_fan_out_max, method_general_fan_out_mean, method_general_fan_out_sum,
-            method_parameters_counts_last, method_parameters_counts_max, method_parameters_counts_mean, method_parameters_counts_sum,
-
-            author_email_last, author_email_sum,
-            method_touched_sum, method_touched_mean, method_fixes_sum, method_fixes_mean,
-
-            (1 if file_buggy else 0), (1 if file_fix else 0), method_buggy_sum, method_buggy_mean, (1 if method_fix else 0), (1 if method_buggy else 0))
-
-        # print('Line count: {}'.format(out_string.count(',')))
-        self.out_file.write(out_string)
-        self.out_file.flush()
+                fields.append(pyarrow.field(name, pyarrow.int64()))
+        self.schema = pyarrow.schema(fields)
+        self.out_file = pyarrow.parquet.ParquetWriter(self.filename, self.schema, compression='zstd')
+
+    def print_csv_header(self):
+        # Column names and types are part of the schema
+        pass
+
+    def encode_rows(self, columns: Dict[str, numpy.ndarray]):
+        import pyarrow
+        batch = pyarrow.RecordBatch.from_arrays([pyarrow.array(columns[name], type=self.schema.field(name).type) for name in CSV_COLUMNS], schema=self.schema)
+        return batch, batch.nbytes
+
+    def write_buffer(self):
+        import pyarrow
+        if self.buffer:
+            self.out_file.write_table(pyarrow.Table.from_batches(self.buffer, schema=self.schema))
+            self.buffer = []
+            self.buffer_bytes = 0
+
+    def sync(self) -> int:
+        self.write_pending()
+        self.write_buffer()
+        return os.path.getsize(self.filename)
+
+    def copy_rows(self, path: str, skip_keys: Set[str]):
+        import pyarrow, pyarrow.compute, pyarrow.parquet
+        self.write_pending()
+        self.write_buffer()
+        skip_keys = pyarrow.array(sorted(key.replace(',', '-comma-') for key in skip_keys), type=pyarrow.string())
+        for batch in pyarrow.parquet.ParquetFile(path).iter_batches():
+            table = pyarrow.Table.from_batches([batch], schema=self.schema)
+            self.out_file.write_table(table.filter(pyarrow.compute.invert(pyarrow.compute.is_in(table['key'], value_set=skip_keys))))
+
+
+class MemorySaver(Saver):
+    """
+    Keeps the aggregated columns in memory instead of writing a file, to use the mined methods in the same process.
+    """
+
+    def __init__(self, batch_size: int = 100000, window: int = WINDOW):
+        super().__init__(None, batch_size, 0, window)
+
+    def create_csv_file(self, truncate_at: int = None):
+        self.buffer = []
+
+    def print_csv_header(self):
+        pass
+
+    def encode_rows(self, columns: Dict[str, numpy.ndarray]):
+        return columns, 0
+
+    def write_buffer(self):
+        # Columns stay in the buffer until get_columns
+        pass
+
+    def sync(self) -> int:
+        self.write_pending()
+        return 0
 
     def close_csv_file(self):
-        self.out_file.flush()
-        self.out_file.close()
+        self.write_pending()
+
+    def get_columns(self) -> Dict[str, numpy.ndarray]:
+        # The same columns of the CSV file, keys and names are lists of strings
+        columns = {}
+        for name in CSV_COLUMNS:
+            parts = [batch[name] for batch in self.buffer]
+            if name in STRING_COLUMNS:
+                columns[name] = [value for part in parts for value in part]
+            else:
+                columns[name] = numpy.concatenate(parts) if parts else numpy.empty(0, dtype=numpy.float64 if name in FLOAT_COLUMNS else numpy.int64)
+        return columns
+
+
+def create_saver(filename: str, output_format: str = 'csv', batch_size: int = 100000, buffer_size: int = 4 * 1024 * 1024, window: int = WINDOW) -> Saver:
+    if output_format == 'parquet':
+        return ParquetSaver(filename, batch_size, buffer_size, window)
+    return Saver(filename, batch_size, buffer_size, window)
@@ -0,0 +1,123 @@
+import os
+from multiprocessing import Pool
+from tempfile import TemporaryDirectory
+from typing import Deque, List, Dict, Set, Tuple
+from pydriller import GitRepository
+
+from method_histories import MethodHistories, get_horizons, join_histories
+from method_metrics import MetricsBean
+from miner import Miner, clone_repository
+from saver import Saver, create_saver, WINDOW
+
+
+class ShardMiner(Miner):
+    """
+    Mines a contiguous slice of the commit range without writing anything.
+    Renames and newly created histories are recorded in order so that the slice can be stitched to the histories left open by the newer slices.
+    """
+
+    def __init__(self, repo_path: str, allowed_extensions: List[str], bic_commits: Set[str], fix_commits: Set[str], cache_path: str = None, cache_size: int = 0, window: int = WINDOW):
+        super().__init__(repo_path, allowed_extensions, None, bic_commits, fix_commits, cache_path=cache_path, cache_size=cache_size, window=window)
+        self.histories = []  # List[Deque[MetricsBean]], the position in the list is the history id
+        self.history_ids = {}  # id(history) -> history id
+        self.events = []  # ('rename', new_path, old_path, commit) or ('start', key, history id) in mining order
+        self.commit_hash = None  # Commit being mined
+        self.flushed = []  # (key, history id) of histories closed by an ADD
+
+    def mine_shard(self, hashes: List[str], horizons: Dict[str, int] = None) -> Dict:
+        methods = MethodHistories()
+        gr = GitRepository(self.repo_path)
+        self.horizons = horizons if horizons is not None else {}
+        self.open_analysis_cache()
+        for commit_hash in hashes:
+            self.commit_hash = commit_hash
+            methods, mod_analyzed_count = self.mine_commit(gr.get_commit(commit_hash), methods, None)
+        self.close_analysis_cache()
+        return {'histories': self.histories,
+                'events': self.events,
+                'flushed': self.flushed,
+                'open': [(key, self.history_ids[id(value)]) for key, value in methods.items()],
+                'window': self.window,
+                'horizon': self.horizons.get(hashes[-1]) if len(hashes) > 0 else None}
+
+    def new_history(self, key: str) -> Deque[MetricsBean]:
+        history = super().new_history(key)
+        self.history_ids[id(history)] = len(self.histories)
+        self.histories.append(history)
+        self.events.append(('start', key, self.history_ids[id(history)]))
+        return history
+
+    def update_keys(self, methods: MethodHistories, new_path: str, old_path: str) -> MethodHistories:
+        self.events.append(('rename', new_path, old_path, self.commit_hash))
+        return super().update_keys(methods, new_path, old_path)
+
+    def flush_methods(self, methods: MethodHistories, key: str, saver: Saver):
+        m = methods.pop(key, None)
+        if m is not None:
+            self.flushed.append((key, self.history_ids[id(m)]))
+        else:
+            print('Unexpected key entry: ' + key)
+
+
+def mine_shard(args: Tuple) -> Tuple[int, int, Dict]:
+    index, repo_path, allowed_extensions, bic_commits, fix_commits, cache_path, cache_size, window, hashes, horizons = args
+    miner = ShardMiner(repo_path, allowed_extensions, bic_commits, fix_commits, cache_path, cache_size, window)
+    return index, len(hashes), miner.mine_shard(hashes, horizons)
+
+
+def mine_methods_sharded(miner: Miner, start_commit: str, stop_commit: str, workers: int) -> int:
+    """
+    Split the commit range in contiguous shards mined by a pool of processes.
+    Shards are merged from the newest to the oldest replaying their renames and new histories on top of the histories left open by the newer shards, so the CSV matches a serial run.
+    """
+    print('Mining: ' + miner.repo_path)
+    gr = GitRepository(miner.repo_path)
+    first_commit, last_commit = miner.resolve_commits(gr, start_commit, stop_commit)
+
+    # The same commits in the same order of a serial run
+    print('Retrieve commits to analyze.')
+    commits = miner.list_commits(gr, first_commit, last_commit)
+    hashes = [commit_hash for commit_hash, timestamp in commits]
+    horizons = get_horizons(commits)
+    shard_size = max(1, -(-len(hashes) // workers))
+    shards = [hashes[n:n + shard_size] for n in range(0, len(hashes), shard_size)]
+    print('Commits to analyze: {} in {} shards'.format(len(hashes), len(shards)))
+
+    # Open CSV file and write header
+    saver = create_saver(miner.csv_file, miner.output_format, miner.batch_size, miner.buffer_size, miner.window)
+    saver.create_csv_file()
+    saver.print_csv_header()
+
+    methods = MethodHistories()  # path$$method -> List[MinerBean] still open at the boundary with the next (older) shard
+    commit_count = 0
+    with TemporaryDirectory(prefix='shards-') as clones_dir, Pool(workers) as pool:
+        clones = [clone_repository(gr, os.path.join(clones_dir, str(i))) for i in range(len(shards))]
+        tasks = [(i, clones[i], miner.allowed_extensions, miner.bic_commits, miner.fix_commits, miner.cache_path, miner.cache_size, miner.window, shards[i],
+                  {commit_hash: horizons[commit_hash] for commit_hash in shards[i]}) for i in range(len(shards))]
+        # imap keeps the shards ordered, a shard is merged as soon as it and all the newer ones are mined
+        for index, shard_commits, shard in pool.imap(mine_shard, tasks):
+            methods = merge_shard(miner, methods, shard, saver)
+            saver.end_commit()
+            commit_count += shard_commits
+            print('Methods: {:>8} | Shard {:>4}/{:<4} | Commit {:>6}/{:<6}'.format(len(methods), index + 1, len(shards), commit_count, len(hashes)))
+    saver.add_methods_to_csv(methods)
+    saver.close_csv_file()
+    print('Mining ended')
+    return commit_count
+
+
+def merge_shard(miner: Miner, methods: MethodHistories, shard: Dict, saver: Saver) -> MethodHistories:
+    histories = shard['histories']
+    # Histories started by the shard continue (going back in the past) the ones open with the same key at that moment
+    for event in shard['events']:
+        if event[0] == 'rename':
+            methods = miner.update_keys(methods, event[1], event[2])
+        else:
+            head = methods.pop(event[1], None)
+            if head is not None:
+                histories[event[2]] = join_histories(head, histories[event[2]], shard['window'], shard['horizon'])
+    for key, history_id in shard['flushed']:
+        saver.add_method_to_csv(key, histories[history_id])
+    for key, history_id in shard['open']:
+        methods[key] = histories[history_id]
+    return methods
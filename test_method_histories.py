@@ -0,0 +1,77 @@
+import random
+import unittest
+from collections import deque
+from datetime import datetime, timezone
+
+from method_histories import append_bean, join_histories, get_horizons
+from method_metrics import MetricsBean
+from saver import aggregate_methods, format_csv_rows
+
+
+def create_bean(index: int, timestamp: int) -> MetricsBean:
+    return MetricsBean('hash{}'.format(index), datetime.fromtimestamp(timestamp, timezone.utc), 'a.cpp', 'f', index, 'MODIFY',
+                       1, index, 1, 10, 2, 30,
+                       1, index % 3, 1, 5, 1, 12,
+                       False, index % 2 == 0,
+                       6, 0, 1, 1, 2,
+                       'author{}@example.com'.format(index % 2),
+                       True, False, index % 4 == 0)
+
+
+def mine(timestamps, window: int) -> deque:
+    # Beans appended in walk order, as Miner.mine_commit does
+    beans = [create_bean(index, timestamp) for index, timestamp in enumerate(timestamps)]
+    horizons = get_horizons([(bean.git_hash, bean.git_committer_timestamp) for bean in beans])
+    history = deque()
+    for bean in beans:
+        append_bean(history, bean, window, horizons[bean.git_hash])
+    return history
+
+
+def get_row(history, window: int) -> str:
+    columns, discarded = aggregate_methods([('a.cpp$$f', list(history))], window)
+    return format_csv_rows(columns)
+
+
+class AppendBeanTest(unittest.TestCase):
+
+    def test_ordered_dates(self):
+        timestamps = [1000, 900, 800, 700, 100, 50]
+        history = mine(timestamps, 150)
+        # Beans too far from the oldest one are dropped while mining, the most recent one stays
+        self.assertEqual([bean.git_committer_timestamp for bean in history], [1000, 100, 50])
+        self.assertEqual(get_row(history, 150), get_row(mine(timestamps, None), 150))
+
+    def test_author_dates_out_of_order(self):
+        timestamps = [300, 200, 0, 100]
+        history = mine(timestamps, 150)
+        self.assertIn(200, [bean.git_committer_timestamp for bean in history])
+        self.assertEqual(get_row(history, 150), get_row(mine(timestamps, None), 150))
+
+    def test_random_dates(self):
+        generator = random.Random(0)
+        for trial in range(500):
+            timestamps = [generator.randint(0, 1000) for index in range(generator.randint(1, 20))]
+            window = generator.randint(1, 400)
+            self.assertEqual(get_row(mine(timestamps, window), window), get_row(mine(timestamps, None), window))
+
+    def test_join_histories(self):
+        generator = random.Random(1)
+        for trial in range(500):
+            timestamps = [generator.randint(0, 1000) for index in range(generator.randint(2, 20))]
+            window = generator.randint(1, 400)
+            split = generator.randint(1, len(timestamps) - 1)
+            beans = [create_bean(index, timestamp) for index, timestamp in enumerate(timestamps)]
+            horizons = get_horizons([(bean.git_hash, bean.git_committer_timestamp) for bean in beans])
+            # Two shards mined apart with the horizons of the whole walk
+            newer, older = deque(), deque()
+            for bean in beans[:split]:
+                append_bean(newer, bean, window, horizons[bean.git_hash])
+            for bean in beans[split:]:
+                append_bean(older, bean, window, horizons[bean.git_hash])
+            history = join_histories(newer, older, window, horizons[beans[-1].git_hash])
+            self.assertEqual(get_row(history, window), get_row(mine(timestamps, None), window))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,46 +1,40 @@
-import argparse, os, numpy
+import argparse, io, os, numpy
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Tuple
+from pydriller import GitRepository
+from urllib.parse import urlparse, parse_qs
 
 from sklearn.preprocessing import StandardScaler
+from batch import BatchMiner
+from loader import METRICS
 from miner import Miner
-from sklearn.externals import joblib
+from model_bundle import load_bundle, standardize
+from saver import CSV_COLUMNS, MemorySaver, aggregate_methods, format_csv_rows, WINDOW
+from xgboost import DMatrix
 import shap
 
+# Rows of the predictions explained with their top features
+EXPLAIN_POLICIES = ['all', 'positive', 'top']
 
-def skipper(fname: str, header=False):
-    with open(fname) as fin:
-        no_comments = (line for line in fin if not line.lstrip().startswith('#'))
-        if header:
-            next(no_comments, None)  # skip header
-        for row in no_comments:
-            yield row
 
-
-def get_important_features(cutoff, shap_values):
-    # Calculate the values that represent the fraction of the model output variability attributable to each feature across the whole dataset.
-    shap_sums = shap_values
+def get_important_features(cutoff, shap_values, count: int = 5) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Indexes and relative importances of the count most important features of each row, in decreasing order of importance.
+    Features below cutoff times the most important one of the row are left out, their index and importance are -1.
+    """
+    # Fraction of the output variability of each row attributable to each feature, a row does not depend on the other explained rows
     abs_shap_sums = numpy.abs(shap_values)
-    rel_shap_sums = abs_shap_sums / abs_shap_sums.sum(0).sum()
-
-    cut_off_value = []
-    for e in rel_shap_sums:
-        cut_off_value.append(cutoff * numpy.amax(e))
-
-    top_feature_indices = []
-    top_features_list = []
-    for i in range(len(cut_off_value)):
-        # Get indices of features that pass the cut off value
-        top_feature_indices.append(numpy.where(rel_shap_sums[i] >= cut_off_value[i])[0])
-        # Get the importance values of the top features from their indices
-        top_features = numpy.take(rel_shap_sums[i], top_feature_indices[i])
-        # Gets the sign of the importance from shap_sums as boolean
-        is_positive = (numpy.take(shap_sums[i], top_feature_indices[i])) >= 0
-        # Stack the importance, indices and shap_sums in a 2D array
-        top_features = numpy.column_stack((top_features, top_feature_indices[i], is_positive))
-        # Sort the array (in decreasing order of importance values)
-        top_features = top_features[top_features[:, 0].argsort()][::-1]
-        top_features_list.append(top_features)
-
-    return top_features_list
+    row_sums = abs_shap_sums.sum(1, keepdims=True)
+    rel_shap_sums = numpy.divide(abs_shap_sums, row_sums, out=numpy.zeros_like(abs_shap_sums, dtype=numpy.float64), where=row_sums > 0)
+    cut_off_value = cutoff * numpy.amax(rel_shap_sums, axis=1, keepdims=True)
+
+    # Sort each row in decreasing order of importance, equal values by decreasing index
+    top_indexes = numpy.argsort(rel_shap_sums, axis=1, kind='stable')[:, ::-1][:, :count]
+    top_importances = numpy.take_along_axis(rel_shap_sums, top_indexes, axis=1)
+    below = top_importances < cut_off_value
+    top_indexes[below] = -1
+    top_importances[below] = -1
+    return top_indexes, top_importances
 
 
 def build_message(file_name, method_name, top_features_name, top_features_value, i):
@@ -56,9 +50,181 @@ def build_message(file_name, method_name, top_features_name, top_features_value,
     feature_5_name = top_features_name[4][i]
     feature_5_value = top_features_value[4][i]
 
+    # Rows left out by the explain policy have no top features
+    if feature_1_name == 'None':
+        return "{} method in {} file is not explained".format(method_name, file_name)
     return "{} method in {} file is prone to be defective due to {} value too high for the feature {}".format(method_name, file_name, feature_1_value, feature_1_name)
 
 
+def mine_touched_methods(repo_path: str, ext: str, start: str, stop: str, cache_path: str, cache_size: int, window: int = WINDOW) -> Dict[str, numpy.ndarray]:
+    """
+    Mine the methods touched by the start commit with their history up to the stop commit.
+    Return the columns of the CSV file kept in memory, None when no method is touched.
+    """
+    # Get a list of touched methods in the last commit
+    miner = Miner(repo_path, ext, None, cache_path=cache_path, cache_size=cache_size, window=window)
+    allowed_methods, allowed_files = miner.find_touched_methods(start)
+    print('Check for ' + str(len(allowed_methods)) + ' methods in ' + str(len(allowed_files)) + ' files')
+
+    # Calculate metrics for touched commits only up to stop commit
+    saver = MemorySaver(window=window)
+    miner.mine_methods(start, stop, allowed_methods, allowed_files, saver=saver)
+    columns = saver.get_columns()
+    return columns if len(columns['key']) > 0 else None
+
+
+def read_batch(repo_path: str, batch: str) -> List[str]:
+    # A text file with a commit HASH per line, or a GIT range such as A..B
+    if os.path.isfile(batch):
+        with open(batch, 'r') as fin:
+            return [line.strip() for line in fin if line.strip()]
+    return GitRepository(repo_path).repo.git.rev_list(batch).split()
+
+
+def mine_batch(repo_path: str, ext: str, commits: List[str], stop: str, cache_path: str, cache_size: int, window: int = WINDOW) -> Tuple[Dict[str, numpy.ndarray], List[str]]:
+    """
+    Mine at once the histories of the methods touched by many commits, return their columns and the commit of each row.
+    """
+    miner = BatchMiner(repo_path, ext, cache_path, cache_size, window)
+    histories = miner.mine_batch(commits, stop)
+    if len(histories) == 0:
+        return None, []
+    columns, discarded = aggregate_methods([(key, history) for commit_hash, key, history in histories], window)
+    return columns, [commit_hash for commit_hash, key, history in histories]
+
+
+def load_model(model_path: str):
+    # Load the pre-trained model bundle and prepare its explainer
+    print('Load trained model: ' + model_path)
+    # model = keras.models.load_model(args.model)
+    # model.summary()
+    bundle = load_bundle(model_path)
+    if bundle['features'] is None:
+        print('The model has no fitted scaler, the input will be standardized on the predicted methods only')
+    elif bundle['features'] != METRICS:
+        print('The model was trained on different features: ' + ','.join(bundle['features']))
+        exit(-1)
+    explainer = shap.TreeExplainer(bundle['model'])
+    return bundle, explainer
+
+
+def get_explained_rows(y_pred_bin: numpy.ndarray, y_pred_proba: numpy.ndarray, explain: str, explain_top: int) -> numpy.ndarray:
+    if explain == 'positive':
+        return numpy.flatnonzero(y_pred_bin)
+    if explain == 'top':
+        # The explain_top methods most likely to be defective
+        return numpy.sort(numpy.argsort(-y_pred_proba[:, 1], kind='stable')[:explain_top])
+    return numpy.arange(len(y_pred_bin))
+
+
+def get_shap_values(model, explainer, x: numpy.ndarray, approximate: bool) -> numpy.ndarray:
+    if approximate:
+        # Contributions approximated by XGBoost while walking the trees (Saabas), the last column is the bias
+        return model.get_booster().predict(DMatrix(x), pred_contribs=True, approx_contribs=True)[:, :-1]
+    shap_values = explainer.shap_values(x)
+    if isinstance(shap_values, list):
+        shap_values = numpy.sum(numpy.abs(shap_values), axis=0)
+    return shap_values
+
+
+def write_predictions(columns: Dict[str, numpy.ndarray], bundle: Dict, explainer, outfile, commits: List[str] = None, explain: str = 'all', explain_top: int = 20, approximate: bool = False) -> int:
+    # Input features of the fresh mined methods
+    x = numpy.column_stack([columns[name] for name in METRICS]).astype(numpy.float64)
+    # Standardizing the input feature as the training set
+    if bundle['mean'] is not None:
+        x = standardize(bundle, x)
+    else:
+        sc = StandardScaler()
+        x = sc.fit_transform(x)
+    model = bundle['model']
+
+    y_pred_bin = model.predict(x)
+    y_pred_proba = model.predict_proba(x)
+    y_pred_bin = (y_pred_bin > 0.5)
+
+    # Explain only the rows selected by the policy, the others have no top features
+    importance_cutoff = 0.15
+    explained = get_explained_rows(y_pred_bin, y_pred_proba, explain, explain_top)
+    top_indexes = numpy.full((len(x), 5), -1)
+    top_importances = numpy.full((len(x), 5), -1.0)
+    if len(explained) > 0:
+        shap_values = get_shap_values(model, explainer, x[explained], approximate)
+        top_indexes[explained], top_importances[explained] = get_important_features(importance_cutoff, shap_values)
+    # Names and values by rank, missing features are None with importance -1
+    top_features_name = numpy.array(METRICS + ['None'], dtype=object)[top_indexes].T
+    top_features_value = top_importances.astype(object)
+    top_features_value[top_indexes < 0] = -1
+    top_features_value = top_features_value.T
+
+    # Same cells of the CSV file written by the miner
+    # In batch mode each row starts with the predicted commit
+    header = ('commit,' if commits is not None else '') + ','.join(CSV_COLUMNS[:-4]) + ',prediction,prediction_false,prediction_true,' \
+             + 'top_feature_1' + ',' + 'top_feature_1_val,' \
+             + 'top_feature_2' + ',' + 'top_feature_2_val,' \
+             + 'top_feature_3' + ',' + 'top_feature_3_val,' \
+             + 'top_feature_4' + ',' + 'top_feature_4_val,' \
+             + 'top_feature_5' + ',' + 'top_feature_5_val,' \
+             + 'message' + '\n'
+    rows = [line.split(',') for line in format_csv_rows(columns).splitlines()]
+    messages = [build_message(cells[2], cells[3], top_features_name, top_features_value, i) for i, cells in enumerate(rows)]
+    for i in numpy.flatnonzero(y_pred_bin):
+        print(messages[i])
+    row_format = ('{},' if commits is not None else '') + '{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n'
+    lines = [row_format.format(*([commits[i]] if commits is not None else []), ','.join(cells[:-4]), 'TRUE' if y_pred_bin[i] else 'FALSE', y_pred_proba[i][0], y_pred_proba[i][1],
+                               *[cell for j in range(5) for cell in (top_features_name[j][i], top_features_value[j][i])], messages[i]) for i, cells in enumerate(rows)]
+    outfile.write(header + ''.join(lines))
+    defective_methods = int(numpy.count_nonzero(y_pred_bin))
+    return defective_methods
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    """
+    GET /predict?start=HASH[&stop=HASH] mines the methods touched by the start commit and answers with the CSV rows tester.py writes in its output file.
+    Requests are served one at a time by a process that keeps the model and its explainer loaded.
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path != '/predict' or 'start' not in query:
+            self.send_error(400, 'Usage: /predict?start=HASH[&stop=HASH]')
+            return
+        server = self.server
+        start = query['start'][0]
+        stop = query['stop'][0] if 'stop' in query else server.args.stop
+        try:
+            output = io.StringIO()
+            columns = mine_touched_methods(server.args.repo, server.args.ext, start, stop, server.args.cache, server.args.cache_size * 1024 * 1024, server.args.window * 24 * 3600)
+            if columns is not None:
+                defective_methods = write_predictions(columns, server.bundle, server.explainer, output, None, server.args.explain, server.args.explain_top, server.args.approximate)
+                print('Found {} defective methods in {}'.format(defective_methods, start))
+            else:
+                print('No methods touched in {}'.format(start))
+        except Exception as e:
+            self.send_error(500, 'Unable to predict {}: {}'.format(start, e))
+            return
+        data = output.getvalue().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve(port: int, args, bundle: Dict, explainer):
+    # Bound to the loopback interface only
+    server = HTTPServer(('127.0.0.1', port), PredictionHandler)
+    server.args = args
+    server.bundle = bundle
+    server.explainer = explainer
+    print('Serving predictions on http://127.0.0.1:{}/predict?start=HASH'.format(port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
 # Main
 if __name__ == '__main__':
     print("*** Tester started ***\n")
@@ -70,117 +236,48 @@ if __name__ == '__main__':
     parser.add_argument('-p', '--stop', type=str, help='Stop HASH commit, if not specified it analyzes up to the end.', default='cdbcb714639a3396c6a04d2e91d117a417a9426b')
     parser.add_argument('-o', '--output', type=str, help='Path of the CSV file where to save results.', default='data/testing_output.csv')
     parser.add_argument('-m', '--model', type=str, help='Path of the machine learning model.', default='data/joblib.dump')
+    parser.add_argument('-a', '--cache', type=str, help='Path of the cache of the Lizard analysis of every mined file version, shared among runs.', default=None)
+    parser.add_argument('-as', '--cache_size', type=int, help='Maximum size of the analysis cache in MB.', default=2048)
+    parser.add_argument('-wd', '--window', type=int, help='Days of changes aggregated for each method, the same used to extract the training dataset.', default=WINDOW // (24 * 3600))
+    parser.add_argument('-b', '--batch', type=str, help='Predict many commits in a single run, sharing the mining of their history up to the stop commit: a text file with a commit HASH per line, or a GIT range such as A..B', default=None)
+    parser.add_argument('-x', '--explain', type=str, choices=EXPLAIN_POLICIES, help='Methods whose prediction is explained with their top features: all, only the ones predicted defective (positive), or the --explain_top most likely defective (top).', default='all')
+    parser.add_argument('-xt', '--explain_top', type=int, help='Number of methods explained with the top policy.', default=20)
+    parser.add_argument('--approximate', action='store_true', help='Explain with the approximated contributions calculated by XGBoost instead of the exact SHAP values.')
+    parser.add_argument('--serve', type=int, help='Keep the model loaded and serve predictions on the given localhost port, the stop commit is the default of the requests.', default=None)
     args, unknown = parser.parse_known_args()
 
-    temp_csv = 'temp.csv'
-    temp2_csv = 'temp2.csv'
-
-    if args.start is None or args.stop is None:
+    if (args.start is None or args.stop is None) and args.serve is None:
         print('A pair of commit HASHs must be passed as input!')
         exit(-1)
     if not os.path.isfile(args.model):
         print('A valid trained model must be passed ad input argument!')
         exit(-1)
 
-    # Get a list of touched methods in the last commit
-    miner = Miner(args.repo, args.ext, temp_csv)
-    miner.mine_methods(args.start, args.start)
-
-    # Count the number of columns into which split dataset
-    fin = open(temp_csv, mode='r')
-    header = fin.readline()
-    features = header.split(',')
-    column_count = len(features)
-
-    # Read remaining rows to extract files and methods
-    allowed_methods = set()
-    allowed_files = set()
-    for line in fin.readlines():
-        cols = line.split(',')
-        touched = int(cols[78])  # Touched sum (this is a binary value since at this point only one commit is inspected)
-        if touched > 0:
-            allowed_methods.add(cols[0])  # Entire key
-            allowed_files.add(cols[2])  # Full paths
-    fin.close()
-    print('Check for ' + str(len(allowed_methods)) + ' methods in ' + str(len(allowed_files)) + ' files')
-
-    # Calculate metrics for touched commits only up to stop commit
-    miner = Miner(args.repo, args.ext, temp2_csv)
-    miner.mine_methods(args.start, args.stop, allowed_methods, allowed_files)
-
-    # Read the CSV file that contains fresh mined metrics
-    if sum(1 for line in open(temp2_csv)) > 1:
-        dataset = numpy.loadtxt(skipper(temp2_csv, True), delimiter=",", usecols=(range(5, column_count - 8)))
-        # split into input (X) and output (Y) variables
-        x = dataset[:, :]
-        # Standardizing the input feature
-        sc = StandardScaler()
-        x = sc.fit_transform(x)
-
-        # Load TensorFlow pre-trained model and perform a prediction
-        print('Load trained model: ' + args.model)
-        # model = keras.models.load_model(args.model)
-        # model.summary()
-        model = joblib.load(args.model)
-        y_pred_bin = model.predict(x)
-        y_pred_proba = model.predict_proba(x)
-        y_pred_bin = (y_pred_bin > 0.5)
-
-        explainer = shap.TreeExplainer(model)
-        shap_values = explainer.shap_values(x)
-
-        if isinstance(shap_values, list):
-            shap_values = numpy.sum(numpy.abs(shap_values), axis=0)
-
-        importance_cutoff = 0.15
-        top_importances = get_important_features(importance_cutoff, shap_values)
-
-        top_features_name = ([], [], [], [], [])
-        top_features_value = ([], [], [], [], [])
-        for i in range(len(x)):
-            top_indexes = [int(index) for importance, index, is_positive in top_importances[i]]
-            top_importance = [importance for importance, index, is_positive in top_importances[i]]
-            for j in range(5):
-                if len(top_indexes) > j:
-                    feature = features[top_indexes[j] + 5]
-                    importance = top_importance[j]
-                else:
-                    feature = "None"
-                    importance = -1
-                top_features_name[j].append(feature)
-                top_features_value[j].append(importance)
-
-        # Read CSV file
-        defective_methods = 0
-        with open(temp2_csv, mode='r') as infile:
+    if args.batch is not None:
+        commits = read_batch(args.repo, args.batch)
+        print('Commits to predict: {}'.format(len(commits)))
+        columns, commits = mine_batch(args.repo, args.ext, commits, args.stop, args.cache, args.cache_size * 1024 * 1024, args.window * 24 * 3600)
+        if columns is not None:
+            bundle, explainer = load_model(args.model)
             with open(args.output, mode='w') as outfile:
-                header = infile.readline().strip().split(',')
-                header = ','.join(header[:-4]) + ',prediction,prediction_false,prediction_true,' \
-                         + 'top_feature_1' + ',' + 'top_feature_1_val,' \
-                         + 'top_feature_2' + ',' + 'top_feature_2_val,' \
-                         + 'top_feature_3' + ',' + 'top_feature_3_val,' \
-                         + 'top_feature_4' + ',' + 'top_feature_4_val,' \
-                         + 'top_feature_5' + ',' + 'top_feature_5_val,' \
-                         + 'message' + '\n'
-                outfile.write(header)
-                i = 0
-                lines = infile.readlines()
-                for line in lines:
-                    columns = line.strip().split(',')
-                    if y_pred_bin[i]:
-                        print(build_message(columns[2], columns[3], top_features_name, top_features_value, i))
-                        defective_methods += 1
-                    buggy = 'TRUE' if y_pred_bin[i] else 'FALSE'
-                    outfile.write('{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n'.format(','.join(columns[:-4]), buggy, y_pred_proba[i][0],y_pred_proba[i][1],
-                                                                                       top_features_name[0][i], top_features_value[0][i],
-                                                                                       top_features_name[1][i], top_features_value[1][i],
-                                                                                       top_features_name[2][i], top_features_value[2][i],
-                                                                                       top_features_name[3][i], top_features_value[3][i],
-                                                                                       top_features_name[4][i], top_features_value[4][i],
-                                                                                       build_message(columns[2], columns[3], top_features_name, top_features_value, i)))
-                    i += 1
-        print('Found {} defective methods'.format(defective_methods))
+                defective_methods = write_predictions(columns, bundle, explainer, outfile, commits, args.explain, args.explain_top, args.approximate)
+            print('Found {} defective methods in {} commits'.format(defective_methods, len(set(commits))))
+        else:
+            print('No methods touched')
+    elif args.serve is not None:
+        if args.repo is None or not os.path.isdir(args.repo):
+            print('A valid path to a GIT repository must be specified!')
+            exit(-1)
+        bundle, explainer = load_model(args.model)
+        serve(args.serve, args, bundle, explainer)
     else:
-        print('No methods touched')
+        columns = mine_touched_methods(args.repo, args.ext, args.start, args.stop, args.cache, args.cache_size * 1024 * 1024, args.window * 24 * 3600)
+        if columns is not None:
+            bundle, explainer = load_model(args.model)
+            with open(args.output, mode='w') as outfile:
+                defective_methods = write_predictions(columns, bundle, explainer, outfile, None, args.explain, args.explain_top, args.approximate)
+            print('Found {} defective methods'.format(defective_methods))
+        else:
+            print('No methods touched')
 
     print("\n*** Tester ended ***")
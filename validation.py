@@ -0,0 +1,79 @@
+import os, random
+from itertools import product
+from multiprocessing import Pool
+from typing import List, Dict, Tuple
+
+import numpy
+from sklearn import metrics
+from sklearn.model_selection import StratifiedKFold
+from xgboost import XGBClassifier
+
+# XGBClassifier settings explored by default by the hyperparameter search
+DEFAULT_GRID = {'n_estimators': [100, 300],
+                'max_depth': [3, 6, 9],
+                'learning_rate': [0.05, 0.1, 0.3],
+                'subsample': [0.8, 1.0]}
+
+SEARCH_TYPES = ['none', 'grid', 'random']
+
+
+def get_candidates(search: str, grid: Dict[str, List], iterations: int, seed: int = None) -> List[Dict]:
+    # Every combination of the grid, or a random sample of iterations of them
+    if search == 'none':
+        return [{}]
+    names = sorted(grid)
+    candidates = [dict(zip(names, values)) for values in product(*[grid[name] for name in names])]
+    if search == 'random' and iterations < len(candidates):
+        candidates = random.Random(seed).sample(candidates, iterations)
+    return candidates
+
+
+def create_model(params: Dict, threads: int) -> XGBClassifier:
+    # Histogram based trees, a model uses the CPUs left to it by the other processes
+    return XGBClassifier(tree_method='hist', n_jobs=threads, **params)
+
+
+# Dataset, folds and candidates of each validation worker, inherited from the parent process instead of sent with every task
+worker_state = {}
+
+
+def init_worker(x: numpy.ndarray, y: numpy.ndarray, folds: List[Tuple[numpy.ndarray, numpy.ndarray]], candidates: List[Dict], threads: int):
+    worker_state.update(x=x, y=y, folds=folds, candidates=candidates, threads=threads)
+
+
+def evaluate_fold(task: Tuple[int, int]) -> Tuple[int, int, float, float, float]:
+    candidate, fold = task
+    x, y = worker_state['x'], worker_state['y']
+    train, test = worker_state['folds'][fold]
+    model = create_model(worker_state['candidates'][candidate], worker_state['threads'])
+    model.fit(x[train], y[train])
+    y_pred = model.predict(x[test]) > 0.5
+    return candidate, fold, metrics.accuracy_score(y[test], y_pred), metrics.f1_score(y[test], y_pred), metrics.matthews_corrcoef(y[test], y_pred)
+
+
+def cross_validate(x: numpy.ndarray, y: numpy.ndarray, candidates: List[Dict], kfolds: int, workers: int) -> List[Dict]:
+    """
+    Evaluate every candidate setting of XGBClassifier with stratified k-fold cross validation, all the folds of all the candidates run in a pool of processes.
+    Return for each candidate its settings and the mean and standard deviation of accuracy, F-score and MCC, best MCC first.
+    """
+    folds = list(StratifiedKFold(n_splits=kfolds, shuffle=True).split(x, y))
+    tasks = [(candidate, fold) for candidate in range(len(candidates)) for fold in range(kfolds)]
+    workers = max(1, min(workers, len(tasks)))
+    threads = max(1, os.cpu_count() // workers)
+    scores = [{'Accuracy': [], 'F-score': [], 'MCC': []} for candidate in candidates]
+    print('Cross validation: {} settings x {} folds on {} processes'.format(len(candidates), kfolds, workers))
+    with Pool(workers, initializer=init_worker, initargs=(x, y, folds, candidates, threads)) as pool:
+        for candidate, fold, accuracy, f1, mcc in pool.imap_unordered(evaluate_fold, tasks):
+            print('Setting {:>3} fold {:>2}: Accuracy: {:.2f} F-score: {:.2f} MCC: {:.2f}'.format(candidate, fold, accuracy, f1, mcc))
+            scores[candidate]['Accuracy'].append(accuracy)
+            scores[candidate]['F-score'].append(f1)
+            scores[candidate]['MCC'].append(mcc)
+
+    results = []
+    for params, score in zip(candidates, scores):
+        result = {'params': params}
+        for name, values in score.items():
+            result[name] = (numpy.mean(values), numpy.std(values))
+        results.append(result)
+    results.sort(key=lambda result: result['MCC'][0], reverse=True)
+    return results